@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from config import Config
+from models import Agent
+from prompts import instructions_hash, normalize_prompt
+import metrics
+
+# Read-through cache of the agent metadata used by the chat routes, so that chat requests and widget loads do not
+# query the database. Entries are dropped explicitly whenever an agent changes (invalidate must be called after
+# the change is committed). A read that started before an invalidation is not stored, so a stale row never
+# replaces a fresh one.
+class AgentCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}  # agent_name -> number of invalidations
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    # Get the cached metadata of an agent, or None
+    def get(self, agent_name: str):
+        with self._lock:
+            agent = self._entries.get(agent_name)
+            if agent is not None:
+                self._entries.move_to_end(agent_name)
+                self._hits += 1
+            else:
+                self._misses += 1
+        metrics.increment('agent_cache_hits' if agent is not None else 'agent_cache_misses')
+        return agent
+
+    # Get the version to pass to put() for a read starting now
+    def version(self, agent_name: str):
+        with self._lock:
+            return self._versions.get(agent_name, 0)
+
+    # Store the metadata of an agent read at the given version, unless the agent changed since
+    def put(self, agent_name: str, agent: dict, version: int):
+        with self._lock:
+            if self._versions.get(agent_name, 0) != version:
+                return
+            self._entries[agent_name] = agent
+            self._entries.move_to_end(agent_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # Drop the metadata of an agent
+    def invalidate(self, agent_name: str):
+        with self._lock:
+            self._entries.pop(agent_name, None)
+            self._versions[agent_name] = self._versions.get(agent_name, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+cache = AgentCache(Config.AGENT_CACHE_SIZE)
+
+# Helper function to get the precomputed answers of an agent that are still valid, keyed by normalized prompt
+def valid_suggested_answers(agent):
+    stored = agent.suggested_answers or {}
+    if stored.get("instructions_hash") != instructions_hash(agent.instructions):
+        return {}
+    prompts = {normalize_prompt(prompt) for prompt in agent.suggested_prompts or []}
+    return {prompt: answer for prompt, answer in stored.get("answers", {}).items() if prompt in prompts}
+
+# Read the metadata of an agent from the database and cache it (needs an app context), or None if there is no such agent
+def load_agent(agent_name: str):
+    version = cache.version(agent_name)
+    agent = Agent.query.filter_by(name=agent_name).first()
+    if not agent:
+        return None
+    metadata = {
+        "name": agent.name,
+        "instructions": agent.instructions,
+        "welcome_message": agent.welcome_message,
+        "suggested_prompts": agent.suggested_prompts or [],
+        "status": agent.status,
+        "answer_cache": bool(agent.answer_cache),
+        "suggested_answers": valid_suggested_answers(agent),
+    }
+    cache.put(agent_name, metadata, version)
+    return metadata
+
+# Get the metadata of an agent from the cache, reading it from the database on a miss (needs an app context)
+def get_agent(agent_name: str):
+    return cache.get(agent_name) or load_agent(agent_name)
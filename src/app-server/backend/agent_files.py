@@ -0,0 +1,77 @@
+import os
+import hashlib
+from datetime import datetime
+from sqlalchemy import JSON, null
+from database import db
+from models import Agent, AgentFile
+
+# The documents of an agent, one agent_files row each, so that an agent with thousands of files is updated, listed
+# and reindexed file by file. Every function needs an app context and leaves the commit to the caller.
+
+# Helper function to read the size, content hash and modification time of a file without reading it all into memory
+def file_metadata(file_path: str):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "content_hash": sha256.hexdigest(), "mtime": datetime.fromtimestamp(stat.st_mtime)}
+
+# Get the filenames of an agent, in name order
+def filenames(agent_id: int):
+    rows = db.session.query(AgentFile.filename).filter_by(agent_id=agent_id).order_by(AgentFile.filename).all()
+    return [row.filename for row in rows]
+
+# Add or refresh the rows of files saved in the agent directory; they wait for the next embeddings job
+def save_rows(agent: Agent, agent_dir: str, saved_filenames: list):
+    if not saved_filenames:
+        return
+    existing = {row.filename: row for row in AgentFile.query.filter(AgentFile.agent_id == agent.id,
+                                                                   AgentFile.filename.in_(saved_filenames))}
+    now = datetime.now()
+    for filename in set(saved_filenames):
+        row = existing.get(filename)
+        if row is None:
+            row = AgentFile(agent_id=agent.id, filename=filename, created_at=now)
+            db.session.add(row)
+        for key, value in file_metadata(os.path.join(agent_dir, filename)).items():
+            setattr(row, key, value)
+        row.embeddings_status = "I"
+        row.updated_at = now
+
+# Remove the rows of deleted files
+def delete_rows(agent: Agent, deleted_filenames: list):
+    if deleted_filenames:
+        AgentFile.query.filter(AgentFile.agent_id == agent.id, AgentFile.filename.in_(deleted_filenames)) \
+            .delete(synchronize_session=False)
+
+# Remove every row of an agent
+def delete_all_rows(agent: Agent):
+    AgentFile.query.filter_by(agent_id=agent.id).delete(synchronize_session=False)
+
+# Record the end of an embeddings job on the files it was indexing ("" done, "E" failed). embedded_files maps the
+# files the job embedded to their hash and chunk count; a file the job found unchanged keeps its chunk count.
+def finish_rows(agent: Agent, embeddings_status: str, embedded_files: dict = None):
+    embedded_files = embedded_files or {}
+    pending = AgentFile.query.filter(AgentFile.agent_id == agent.id,
+                                     (AgentFile.embeddings_status == "I") | AgentFile.filename.in_(list(embedded_files)))
+    now = datetime.now()
+    for row in pending:
+        row.embeddings_status = embeddings_status
+        embedded = embedded_files.get(row.filename)
+        if embeddings_status == "" and embedded and embedded.get("hash") == row.content_hash:
+            row.chunks = embedded.get("chunks")
+        row.updated_at = now
+
+# Move the legacy Agent.files lists into agent_files (runs at startup; each agent is moved once). The column is
+# cleared to SQL NULL: None would store JSON 'null', which the filter must also skip for agents moved that way.
+def migrate_legacy_files(agents_dir: str):
+    for agent in Agent.query.filter(Agent.files.isnot(None), Agent.files != JSON.NULL):
+        agent_dir = os.path.join(agents_dir, agent.name)
+        saved = [filename for filename in agent.files or [] if os.path.isfile(os.path.join(agent_dir, filename))]
+        save_rows(agent, agent_dir, saved)
+        # The files were indexed with the agent, so they share its status
+        for row in AgentFile.query.filter_by(agent_id=agent.id):
+            row.embeddings_status = agent.embeddings_status or ""
+        agent.files = null()
+    db.session.commit()
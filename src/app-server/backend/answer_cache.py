@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import Config
+
+# Cache of the answers to first chat turns, per agent. A prompt whose embedding is close enough to the one of an
+# answered prompt gets the same answer, as long as the answer was produced with the same fingerprint (agent
+# instructions, embedding model, index version and LLM model). Each agent keeps its most recently used entries.
+class AnswerCache:
+    def __init__(self, max_entries_per_agent: int, min_similarity: float):
+        self.max_entries_per_agent = max_entries_per_agent
+        self.min_similarity = min_similarity
+        self._entries = {}  # agent_name -> OrderedDict of entry id -> (fingerprint, unit vector, answer)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    # Helper function to normalize a vector to unit length (so dot products are cosine similarities)
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    # Get the cached answer to a prompt similar to the given one, or None
+    def lookup(self, agent_name: str, embedding, fingerprint):
+        query = self._unit(embedding)
+        with self._lock:
+            entries = self._entries.get(agent_name)
+            if entries:
+                # Entries produced with another fingerprint can never be used again
+                for entry_id in [entry_id for entry_id, entry in entries.items() if entry[0] != fingerprint]:
+                    del entries[entry_id]
+            if not entries:
+                self._misses += 1
+                return None
+            entry_ids = list(entries)
+            similarities = np.stack([entries[entry_id][1] for entry_id in entry_ids]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.min_similarity:
+                self._misses += 1
+                return None
+            entries.move_to_end(entry_ids[best])
+            self._hits += 1
+            return entries[entry_ids[best]][2]
+
+    # Store the answer to a prompt, evicting the least recently used entry of the agent when it is full
+    def store(self, agent_name: str, embedding, fingerprint, answer: str):
+        vector = self._unit(embedding)
+        with self._lock:
+            entries = self._entries.setdefault(agent_name, OrderedDict())
+            entries[self._next_id] = (fingerprint, vector, answer)
+            self._next_id += 1
+            while len(entries) > self.max_entries_per_agent:
+                entries.popitem(last=False)
+
+    # Drop every answer of an agent (its instructions, documents or settings changed)
+    def invalidate(self, agent_name: str):
+        with self._lock:
+            self._entries.pop(agent_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "agents": len(self._entries),
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
+
+cache = AnswerCache(Config.ANSWER_CACHE_SIZE, Config.ANSWER_CACHE_MIN_SIMILARITY)
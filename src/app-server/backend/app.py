@@ -6,12 +6,22 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import shutil
 import re
-import requests
-from datetime import timedelta, datetime
-from models import Agent, User
-from database import db
+from datetime import timedelta, datetime, timezone
+from sqlalchemy import func
+import hashlib
+from models import Agent, AgentFile, User
+from database import db, add_missing_columns
+import metrics
+import upstream
+import llm
+import answer_cache
+import agent_cache
+import agent_files
+import sessions
+from scheduler import scheduler
 import os
 import threading
+import time
 
 
 app = Flask(__name__, static_folder='dist/assets', template_folder='dist')
@@ -20,7 +30,7 @@ app = Flask(__name__, static_folder='dist/assets', template_folder='dist')
 app.config.from_object('config.Config')
 
 # Initialize CORS with allowed origins from the environment variable
-CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ALLOWED_ORIGINS'].split(',')}}, supports_credentials=True)
+CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ALLOWED_ORIGINS'].split(',')}}, supports_credentials=True, expose_headers=["X-Next-Cursor"])
 
 # Initialize database
 db.init_app(app)
@@ -39,6 +49,8 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=app.config['ACCESS_TO
 # Create tables when the app starts (no migrations needed)
 with app.app_context():
     db.create_all()
+    add_missing_columns(Agent)
+    agent_files.migrate_legacy_files(app.config['AGENTS_DIR'])
 
 # Helper function to save files
 def save_files(agent_name, files):
@@ -85,109 +97,155 @@ def sanitize_agent_name(name):
     name = re.sub(r'[^a-z0-9-]', '', name)
     return name
 
-# Helper function to call the embeddings server in a separate thread
-def trigger_embeddings_generation(agent_name):
-    def generate_embeddings_task():
+# Helper function to record the embeddings status of an agent ("I" in progress, "E" failed, "" done) and of the
+# files the job was indexing (embedded_files: hash and chunk count of each file the job embedded)
+def set_embeddings_status(agent_name, embeddings_status, embedded_files=None):
+    agent = Agent.query.filter_by(name=agent_name).first()
+    if not agent:
+        return False
+    agent.embeddings_status = embeddings_status
+    if embeddings_status != "I":
+        agent_files.finish_rows(agent, embeddings_status, embedded_files)
+    agent.updated_at = datetime.now()  # the agents list is revalidated with updated_at
+    db.session.commit()
+    agent_cache.cache.invalidate(agent_name)
+    return True
+
+# Number of the latest embeddings job started for each agent: only the completion of an agent's latest job is
+# recorded, so an earlier job ending after a newer one was started never marks the agent as indexed
+_embeddings_runs = {}
+_embeddings_runs_lock = threading.Lock()
+
+# Helper function to start an embeddings job on the embeddings server, returning its id
+def start_embeddings_job(agent_name):
+    while True:
+        # The embeddings server returns at once with the job id
+        response = upstream.embeddings.request_sync("POST", "/generate", json={"agent_name": agent_name})
+        retry_after = upstream.backpressure_delay(response)
+        if retry_after is None:
+            break
+        # Too many jobs are waiting on the embeddings server: no job was created, so ask again later
+        time.sleep(max(retry_after, app.config['EMBEDDINGS_JOB_POLL_SECONDS']))
+    response.raise_for_status()
+    return response.json()['job_id']
+
+# Helper function to wait for an embeddings job to finish, returning its completion record, or None if the
+# embeddings server no longer knows the job (its record was evicted, or the server restarted).
+# Errors reaching the server are waited out with a growing delay: the job keeps running meanwhile.
+def wait_for_embeddings_job(agent_name, job_id):
+    delay = app.config['EMBEDDINGS_JOB_POLL_SECONDS']
+    while True:
+        time.sleep(delay)
         try:
-            # Call the embeddings server to start generating embeddings
-            response = requests.post(f"http://embeddings-server:{app.config['EMBEDDINGS_SERVER_PORT']}/generate", json={"agent_name": agent_name})
-            # do not wait for response
+            response = upstream.embeddings.request_sync("GET", f"/jobs/{job_id}")
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            job = response.json()['job']
         except Exception as e:
-            print(f"Error during embeddings generation for agent {agent_name}: {str(e)}")
+            print(f"Error checking embeddings job {job_id} for agent {agent_name}, retrying: {str(e)}")
+            delay = min(delay * 2, app.config['EMBEDDINGS_JOB_POLL_MAX_SECONDS'])
+            continue
+        delay = app.config['EMBEDDINGS_JOB_POLL_SECONDS']
+        if job['status'] in ('completed', 'failed', 'cancelled'):
+            return job
+
+# Helper function to start an embeddings job (or follow the given one already running) and follow it to completion
+# in a separate thread
+def trigger_embeddings_generation(agent_name, job_id=None):
+    with _embeddings_runs_lock:
+        run = _embeddings_runs[agent_name] = _embeddings_runs.get(agent_name, 0) + 1
+
+    # Helper function to tell whether the job is still the latest one started for the agent
+    def is_latest():
+        with _embeddings_runs_lock:
+            return _embeddings_runs.get(agent_name) == run
+
+    def generate_embeddings_task():
+        current_job_id = job_id
+        while True:
+            if current_job_id is None:
+                try:
+                    current_job_id = start_embeddings_job(agent_name)
+                except Exception as e:
+                    # No job is running, so the agent cannot become indexed without a new upload
+                    print(f"Error starting embeddings generation for agent {agent_name}: {str(e)}")
+                    if is_latest():
+                        with app.app_context():
+                            set_embeddings_status(agent_name, "E")
+                    return
+            job = wait_for_embeddings_job(agent_name, current_job_id)
+            if job is not None:
+                break
+            # The outcome of the job is lost: index again (only what is not in the index yet is embedded)
+            print(f"Embeddings job {current_job_id} for agent {agent_name} is unknown to the embeddings server, starting a new one")
+            current_job_id = None
+
+        if not is_latest():
+            print(f"Embeddings job {current_job_id} for agent {agent_name} ended with status {job['status']}, superseded by a newer job")
+            return
+        if job['status'] != 'completed':
+            print(f"Embeddings job {current_job_id} for agent {agent_name} ended with status {job['status']}: {job['error']}")
+        # Answers cached before the job were given from the previous index
+        answer_cache.cache.invalidate(agent_name)
+        with app.app_context():
+            if job['status'] == 'completed':
+                set_embeddings_status(agent_name, "", (job['result'] or {}).get('files'))
+            else:
+                set_embeddings_status(agent_name, "E")
+        # Answer the suggested prompts from the new index
+        if job['status'] == 'completed':
+            trigger_suggested_answers(agent_name)
 
     # Run the task in a separate thread
-    threading.Thread(target=generate_embeddings_task).start()
+    threading.Thread(target=generate_embeddings_task, daemon=True).start()
+
+# Helper function to follow again the embeddings jobs of the agents left in progress ("I") by a previous run of the
+# app server: an unfinished job of the agent on the embeddings server is followed, otherwise a new one is started
+def resume_embeddings_generation():
+    with app.app_context():
+        agent_names = [row.name for row in db.session.query(Agent.name).filter(Agent.embeddings_status == "I")]
+    if not agent_names:
+        return
+
+    def resume_task():
+        # The embeddings server may still be starting: wait until it answers
+        delay = app.config['EMBEDDINGS_JOB_POLL_SECONDS']
+        for agent_name in agent_names:
+            while True:
+                try:
+                    response = upstream.embeddings.request_sync("GET", "/jobs", params={"agent_name": agent_name})
+                    response.raise_for_status()
+                    jobs = response.json()['jobs']
+                    break
+                except Exception as e:
+                    print(f"Error listing the embeddings jobs of agent {agent_name}, retrying: {str(e)}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, app.config['EMBEDDINGS_JOB_POLL_MAX_SECONDS'])
+            unfinished = sorted((job for job in jobs if job['status'] in ('queued', 'running')), key=lambda job: job['created_at'])
+            trigger_embeddings_generation(agent_name, unfinished[-1]['job_id'] if unfinished else None)
+
+    threading.Thread(target=resume_task, daemon=True).start()
+
+# Helper function to ask the embeddings server to drop the embeddings of an agent in a separate thread
+def trigger_embeddings_deletion(agent_name):
+    def delete_embeddings_task():
+        try:
+            response = upstream.embeddings.request_sync("DELETE", f"/agents/{agent_name}")
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Error deleting embeddings for agent {agent_name}: {str(e)}")
 
-# Helper function to compose the LLM request
-def compose_request(instruction, document_chunks, history, user_prompt):
-    """
-    Combines the instruction, document chunks, history, and user prompt into a complete prompt
-    for an LLM (vLLM, Ollama, or OpenAI-compatible API).
-    
-    :param instruction: The main system instruction to the LLM (e.g., "You are a Teacher...").
-    :param document_chunks: A list of document chunks relevant to the conversation.
-    :param history: A list of past user prompts and system responses (as a list of dictionaries).
-    :param user_prompt: The latest user input or question.
-    
-    :return: A formatted list of messages to be used for LLM completion API.
-    """
-    
-    # Start with the instruction as the system message
-    messages = [
-        {"role": "system", "content": instruction}
-    ]
-    
-    # Add document chunks as a system message (summarizing or presenting document context)
-    if document_chunks:
-        chunked_documents = "\n\n".join(document_chunks)
-        messages.append({
-            "role": "system",
-            "content": f"The following document chunks are relevant:\n{chunked_documents}"
-        })
-    
-    # Add the past history of user prompts and system responses
-    for entry in history:
-        if "user" in entry:
-            messages.append({"role": "user", "content": entry["user"]})
-        if "assistant" in entry:
-            messages.append({"role": "assistant", "content": entry["assistant"]})
-        if "system" in entry:
-            messages.append({"role": "system", "content": entry["system"]})
-    
-    # Add the latest user prompt
-    messages.append({"role": "user", "content": user_prompt})
-    
-    return messages
+    # Run the task in a separate thread
+    threading.Thread(target=delete_embeddings_task, daemon=True).start()
 
-# Helper function to call the vllm server
-def send_prompt_vllm(messages):
-    try:
-        # Call the vLLM API using requests
-        BASE_URL = f"http://llm-server:{app.config['LLM_SERVER_PORT']}/v1"
-        response = requests.post(
-            f"{BASE_URL}/chat/completions",
-            json={
-                "model": app.config['LLM_MODEL_NAME'],  # Replace with your model's name
-                "messages": messages
-            },
-            timeout=600
-        )
-        response.raise_for_status()
-        response_data = response.json()
-        choices = response_data['choices']
-        choice = choices[0]
-        message = choice['message']
-        resp_json = {
-            "content": message['content'],
-            "role": message['role']
-        }
-        return resp_json
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Error connecting to vLLM server: {str(e)}")
+# Helper function to precompute the answers to an agent's suggested prompts in the background
+def trigger_suggested_answers(agent_name):
+    import chat  # imported here because chat.py imports this module
+    chat.schedule_suggested_answers(agent_name)
 
-# Helper function to call the vllm server
-def send_prompt_ollama(messages):
-    try:
-        # Call the vLLM API using requests
-        BASE_URL = f"http://llm-server:11434"
-        response = requests.post(
-            f"{BASE_URL}/api/chat",
-            json={
-                "model": "phi3", 
-                "messages": messages
-            },
-            timeout=600
-        )
-        response.raise_for_status()
-        response_data = response.json()
-        message = response_data['message']
-        resp_json = {
-            "content": message['content'],
-            "role": message['role']
-        }
-        return resp_json
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Error connecting to vLLM server: {str(e)}")
+# Follow the embeddings jobs left in progress when the app server last stopped
+resume_embeddings_generation()
 
 # now the routes
 
@@ -356,21 +414,55 @@ def list_agents():
             return jsonify({"error": "Access denied"}), 403
         if verify_jwt_in_request(optional=True) == None:
             return jsonify({"error": "Access denied"}), 403
-        # Query the database for all agents
-        agents = Agent.query.all()
-        # Prepare the list of agents to return
-        agents_list = [
-            {
-                "id": agent.id,
-                "name": agent.name,
-                "status": agent.status,
-                "embeddings_status": agent.embeddings_status,
-            }
-            for agent in agents
-        ]
-
-        # Return the list of agents as JSON
-        return jsonify(agents_list), 200
+        # Optional name prefix filter, keyset cursor (the last name of the previous page) and page size
+        prefix = sanitize_agent_name(request.args.get('prefix', ''))
+        after = request.args.get('after', '')
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = min(max(limit, 1), app.config['AGENTS_PAGE_MAX_SIZE'])
+
+        # Helper function to apply the filters to a query
+        def filtered(query):
+            if prefix:
+                query = query.filter(Agent.name.startswith(prefix))
+            if after:
+                query = query.filter(Agent.name > after)
+            return query
+
+        # Validate the client's copy from the newest change, the number of agents and the newest id (deletes and
+        # re-creates change them), before loading any row
+        count, last_updated, last_id = filtered(db.session.query(func.count(Agent.id), func.max(Agent.updated_at), func.max(Agent.id))).one()
+        etag = hashlib.sha256(f"{count}|{last_updated}|{last_id}|{prefix}|{after}|{limit}".encode()).hexdigest()[:32]
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            # Select only the listed columns, in name order
+            query = filtered(db.session.query(Agent.id, Agent.name, Agent.status, Agent.embeddings_status)).order_by(Agent.name)
+            rows = query.limit(limit + 1).all() if limit is not None else query.all()
+            next_cursor = None
+            if limit is not None and len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = rows[-1].name
+            # Prepare the list of agents to return
+            agents_list = [
+                {
+                    "id": row.id,
+                    "name": row.name,
+                    "status": row.status,
+                    "embeddings_status": row.embeddings_status,
+                }
+                for row in rows
+            ]
+            response = make_response(jsonify(agents_list), 200)
+            if next_cursor:
+                response.headers['X-Next-Cursor'] = next_cursor
+
+        # The browser keeps the list and revalidates it on every load
+        response.set_etag(etag)
+        if last_updated:
+            response.last_modified = last_updated if last_updated.tzinfo else last_updated.astimezone(timezone.utc)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     except Exception as e:
         return jsonify({"msg": "Unauthorized action"}), 401
@@ -396,16 +488,18 @@ def create_agent():
         if request.form.get('suggested_prompts'):
             suggested_prompts = request.form.getlist('suggested_prompts')        
         status = request.form.get('status', 'D')
+        answer_cache_on = request.form.get('answer_cache') == 'true'
 
         # Ensure the agent name is unique
         existing_agent = Agent.query.filter_by(name=name).first()
         if existing_agent:
             return jsonify({"msg": "Agent with this name already exists"}), 400
 
-        new_agent = Agent(name=sanitized_name, instructions=instructions, welcome_message=welcome_message,suggested_prompts=suggested_prompts, status=status, created_at=datetime.now(), updated_at=datetime.now())
+        new_agent = Agent(name=sanitized_name, instructions=instructions, welcome_message=welcome_message,suggested_prompts=suggested_prompts, status=status, answer_cache=answer_cache_on, created_at=datetime.now(), updated_at=datetime.now())
 
         db.session.add(new_agent)
         db.session.commit()
+        agent_cache.cache.invalidate(new_agent.name)
 
         return jsonify({"msg": "Agent created successfully", "name": new_agent.name}), 201
     except Exception as e:
@@ -427,6 +521,7 @@ def update_agent_info(agent_name):
         if not agent:
             return jsonify({"msg": "Agent not found"}), 404
 
+        previous_instructions, previous_prompts = agent.instructions, agent.suggested_prompts
         # Update agent's instructions and welcome_message
         agent.instructions = request.form.get('instructions', agent.instructions)
         agent.welcome_message = request.form.get('welcome_message', agent.welcome_message)
@@ -436,19 +531,32 @@ def update_agent_info(agent_name):
             agent.suggested_prompts = list(set(request.form.getlist('suggested_prompts')))
         # updated status and updated_at   
         agent.status = request.form.get('status', agent.status)
+        if 'answer_cache' in request.form:
+            agent.answer_cache = request.form.get('answer_cache') == 'true'
+        # The precomputed answers are stale when the instructions or the suggested prompts change
+        refresh_suggested_answers = agent.instructions != previous_instructions or sorted(agent.suggested_prompts) != sorted(previous_prompts or [])
+        if refresh_suggested_answers:
+            agent.suggested_answers = None
         agent.updated_at=datetime.now()
 
         # Save changes to the database
         db.session.commit()
+        # Cached answers were given with the previous instructions
+        agent_cache.cache.invalidate(agent_name)
+        answer_cache.cache.invalidate(agent_name)
+        # Precompute the new answers now, unless an embeddings job in progress will do it when it completes
+        if refresh_suggested_answers and agent.embeddings_status != "I":
+            trigger_suggested_answers(agent_name)
 
         return_response = {
             "name": agent.name,
             "instructions": agent.instructions,
             "welcome_message": agent.welcome_message,
             "suggested_prompts": agent.suggested_prompts,
-            "files": agent.files,
+            "files": agent_files.filenames(agent.id),
             "status": agent.status,
-            "embeddings_status": agent.embeddings_status
+            "embeddings_status": agent.embeddings_status,
+            "answer_cache": bool(agent.answer_cache)
         }
 
         return jsonify(return_response), 200
@@ -480,23 +588,20 @@ def update_agent_files(agent_name):
         new_files = request.files.getlist('newfiles')
         saved_files = save_files(agent_name, new_files) if new_files else []
 
-        # Ensure agent.files is initialized as a list if it's None
-        if agent.files is None:
-            agent.files = []
-
-        agent.files = [file for file in agent.files if file not in deleted_files] + saved_files
-        # Update the agent's files list (remove deleted files, add new ones)
-        agent.files = [file for file in agent.files if file not in deleted_files] + saved_files
-        # Ensure no duplicate files in agent.files
-        agent.files = list(set(agent.files))
+        # Update only the rows of the deleted and saved files (a saved file replaces the deleted one of the same name)
+        agent_files.delete_rows(agent, [file for file in deleted_files if file not in saved_files])
+        agent_files.save_rows(agent, os.path.join(app.config['AGENTS_DIR'], agent_name), saved_files)
         # set updated filed
         agent.updated_at=datetime.now()
-        # set embedded status to In progress
+        # set embedded status to In progress (the suggested prompts are answered again when it completes)
         agent.embeddings_status="I"
+        agent.suggested_answers = None
         # Save changes to the database
         db.session.commit()
 
-        # Trigger embeddings_generation
+        # Trigger embeddings_generation (cached answers were given from the previous documents)
+        agent_cache.cache.invalidate(agent_name)
+        answer_cache.cache.invalidate(agent_name)
         trigger_embeddings_generation(agent_name)
 
         # Return response
@@ -505,9 +610,10 @@ def update_agent_files(agent_name):
             "instructions": agent.instructions,
             "welcome_message": agent.welcome_message,
             "suggested_prompts": agent.suggested_prompts,
-            "files": agent.files,
+            "files": agent_files.filenames(agent.id),
             "status": agent.status,
-            "embeddings_status": agent.embeddings_status
+            "embeddings_status": agent.embeddings_status,
+            "answer_cache": bool(agent.answer_cache)
         }
 
         return jsonify(return_response), 200
@@ -539,13 +645,55 @@ def get_agent(agent_name):
             "suggested_prompts": agent.suggested_prompts,
             "status": agent.status,
             "embeddings_status": agent.embeddings_status,
-            "files": agent.files  # List of filenames
+            "answer_cache": bool(agent.answer_cache),
+            "files": agent_files.filenames(agent.id)  # List of filenames
         }
 
         return jsonify(agent_details), 200
     except Exception as e:
         return jsonify({"msg": f"Error retrieving agent: {str(e)}"}), 500
 
+# GET method for listing an agent's documents with their size, hash and indexing status
+@app.route('/api/agents/<string:agent_name>/files', methods=['GET'])
+def list_agent_files(agent_name):
+    try:
+        # Check for custom header
+        if request.headers.get('X-Requested-With') != app.config['HEADER_KEY']:
+            return jsonify({"error": "Access denied"}), 403
+
+         # first ensure that valid jwt token has been sent
+        verify_jwt_in_request()
+        # Find the agent by name
+        agent = Agent.query.filter_by(name=agent_name).first()
+        if not agent:
+            return jsonify({"msg": "Agent not found"}), 404
+
+        # Keyset pagination on the filename, optionally only the files with the given embeddings status
+        after = request.args.get('after', '')
+        limit = min(max(request.args.get('limit', app.config['AGENT_FILES_PAGE_MAX_SIZE'], type=int), 1),
+                    app.config['AGENT_FILES_PAGE_MAX_SIZE'])
+        query = AgentFile.query.filter(AgentFile.agent_id == agent.id, AgentFile.filename > after)
+        if 'embeddings_status' in request.args:
+            query = query.filter(AgentFile.embeddings_status == request.args['embeddings_status'])
+        rows = query.order_by(AgentFile.filename).limit(limit + 1).all()
+
+        files_list = [
+            {
+                "filename": row.filename,
+                "size": row.size,
+                "content_hash": row.content_hash,
+                "mtime": row.mtime.isoformat() if row.mtime else None,
+                "embeddings_status": row.embeddings_status,
+                "chunks": row.chunks,
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = rows[limit - 1].filename if len(rows) > limit else None
+
+        return jsonify({"files": files_list, "next": next_cursor}), 200
+    except Exception as e:
+        return jsonify({"msg": f"Error retrieving agent files: {str(e)}"}), 500
+
 # DELETE method for deleting an agent by name
 @app.route('/api/agents/<string:agent_name>', methods=['DELETE'])
 def delete_agent(agent_name):
@@ -566,10 +714,16 @@ def delete_agent(agent_name):
         if os.path.exists(agent_dir):
             shutil.rmtree(agent_dir)  # Recursively delete the directory and its contents
 
-        # Delete the agent record from the database
+        # Delete the agent record and its file records from the database
+        agent_files.delete_all_rows(agent)
         db.session.delete(agent)
         db.session.commit()
 
+        # Drop the agent's embeddings and cached metadata and answers
+        agent_cache.cache.invalidate(agent_name)
+        answer_cache.cache.invalidate(agent_name)
+        trigger_embeddings_deletion(agent_name)
+
         return jsonify({"msg": f"Agent '{agent_name}' deleted successfully"}), 200
     except Exception as e:
         return jsonify({"msg": f"Error deleting agent: {str(e)}"}), 500
@@ -577,13 +731,11 @@ def delete_agent(agent_name):
 @app.route('/api/agents/<string:agent_name>/update-embeddings-status', methods=['POST'])
 def update_embeddings_status(agent_name):
     try:
-        agent = Agent.query.filter_by(name=agent_name).first()
-        if not agent:
-            return jsonify({"msg": "Agent not found"}), 404
-
         # Update the embeddings status to blank (or any other status as needed)
-        agent.embeddings_status = ""
-        db.session.commit()
+        if not set_embeddings_status(agent_name, ""):
+            return jsonify({"msg": "Agent not found"}), 404
+        # Answer the suggested prompts from the completed index
+        trigger_suggested_answers(agent_name)
 
         return jsonify({"msg": "Embeddings status updated successfully"}), 200
     except Exception as e:
@@ -598,56 +750,39 @@ def get_agent_for_chat(agent_name):
         return jsonify({"error": "Access denied"}), 403
 
     try:
-        # Find the agent by name
-        agent = Agent.query.filter_by(name=agent_name).first()
+        # Find the agent by name (from the agent cache when possible)
+        agent = agent_cache.get_agent(agent_name)
         if not agent:
             return jsonify({"msg": "Agent not found"}), 404
 
         # Prepare the agent's details to return
         agent_details = {
-            "name": agent.name,
-            "welcome_message": agent.welcome_message,
-            "suggested_prompts": agent.suggested_prompts,
-            "status": agent.status,
+            "name": agent["name"],
+            "welcome_message": agent["welcome_message"],
+            "suggested_prompts": agent["suggested_prompts"],
+            "status": agent["status"],
         }
 
         return jsonify(agent_details), 200
     except Exception as e:
         return jsonify({"msg": f"Error retrieving agent: {str(e)}"}), 500
 
-@app.route('/api/chat/<string:agent_name>', methods=['POST'])
-def chat_completion(agent_name):
-    try:
-         # Find the agent by name
-        agent = Agent.query.filter_by(name=agent_name).first()
-        if not agent:
-            return jsonify({"msg": "Agent not found"}), 404
-        
-        # convert request
-        data = request.json
-        # extract input and past history
-        input = data['input']
-        messages = data['messages']
-
-        # Call the embeddings server to query for document chunks
-        response = requests.post(f'http://embeddings-server:{app.config['EMBEDDINGS_SERVER_PORT']}/query', json={"agent_name": agent_name, "prompt": input})
-        response_json = response.json()
-        document_chunks = response_json['results']
-        document_text_array = [chunk.replace('\n', ' ') for sublist in document_chunks for chunk in sublist]
+# POST /api/chat/<agent_name> and /api/chat/<agent_name>/stream are served by the async routes in chat.py
 
-        # compose request
-        messages = compose_request(agent.instructions, document_text_array, messages, input)
-
-        print(messages)
-
-        # call vLLM server
-        #llm_response = send_prompt_vllm(messages)
-        llm_response = send_prompt_ollama(messages)
-
-        # return to browser
-        return  jsonify({"success": True, "content": llm_response["content"], "role": llm_response["role"]})
+# GET method for the app server metrics
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    try:
+        # Check for custom header
+        if request.headers.get('X-Requested-With') != app.config['HEADER_KEY']:
+            return jsonify({"error": "Access denied"}), 403
+        # first ensure that valid jwt token has been sent
+        verify_jwt_in_request()
+        return jsonify({**metrics.snapshot(), "upstreams": upstream.stats(), "llm": llm.pool.stats(),
+                        "answer_cache": answer_cache.cache.stats(), "chat_sessions": sessions.store.stats(),
+                        "llm_scheduler": scheduler.stats(), "agent_cache": agent_cache.cache.stats()}), 200
     except Exception as e:
-        return jsonify({"success": False, "content": str(e), "role":"assistant"})
+        return jsonify({"msg": f"Error retrieving metrics: {str(e)}"}), 500
 
 # static files
 @app.route('/', defaults={'path': ''})
@@ -0,0 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from app import app as flask_app
+from config import Config
+import chat
+import upstream
+import llm
+from scheduler import Overloaded
+
+# ASGI entry point of the app server (uvicorn asgi:app).
+# The chat routes are async (chat.py) so that a slow generation only holds a coroutine; every other route
+# is served by the Flask app on a small thread pool, so the admin UI keeps answering while chats are in flight.
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    chat.loop = asyncio.get_running_loop()
+    health_checks = asyncio.create_task(llm.pool.run_health_checks(Config.LLM_HEALTH_CHECK_SECONDS))
+    yield
+    health_checks.cancel()
+    await upstream.close_all()
+
+app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+app.include_router(chat.router)
+
+# The chat routes are not served by Flask, so they need the same CORS policy as flask-cors gives the other routes.
+# Preflight requests are answered here for every route.
+app.add_middleware(CORSMiddleware, allow_origins=[origin for origin in Config.CORS_ALLOWED_ORIGINS.split(',') if origin],
+                   allow_credentials=True, allow_methods=["*"], allow_headers=["*"], expose_headers=["X-Next-Cursor"])
+
+# Answer chat requests rejected by the LLM scheduler with 503 and a hint on when to retry
+@app.exception_handler(Overloaded)
+async def overloaded_exception_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"msg": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+# Everything else goes to the Flask app
+app.mount("/", WSGIMiddleware(flask_app, workers=Config.WSGI_THREADS))
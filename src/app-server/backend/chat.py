@@ -0,0 +1,290 @@
+import asyncio
+import json
+import time
+from typing import List, Optional
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+from config import Config
+from prompts import compose_request, normalize_history, instructions_hash, normalize_prompt
+from models import Agent
+from database import db
+from app import app as flask_app
+import metrics
+import upstream
+import llm
+import answer_cache
+import sessions
+import agent_cache
+from scheduler import scheduler, Overloaded
+
+# Async chat routes: every chat turn waits on the embeddings server and the LLM without holding a thread,
+# so many in-flight chats share one process
+router = APIRouter()
+
+class ChatRequest(BaseModel):
+    input: str
+    messages: List[dict] = []  # history of the conversation, only needed to start a session
+    session_id: Optional[str] = None  # session holding the history of the conversation
+
+# Event loop of the ASGI app, set when it starts; used to run chat work started from the Flask threads
+loop = None
+
+# Helper function to read an agent from the database (synchronous, so this is run on a thread)
+def load_agent(agent_name):
+    with flask_app.app_context():
+        return agent_cache.load_agent(agent_name)
+
+# Helper function to find an agent by name, from the agent cache when possible
+async def find_agent(agent_name):
+    return agent_cache.cache.get(agent_name) or await asyncio.to_thread(load_agent, agent_name)
+
+# Helper function to save the precomputed answers of an agent, unless they are stale: its instructions or
+# suggested prompts changed in the meantime, or its documents are being indexed again
+def save_suggested_answers(agent_name, used_instructions_hash, used_prompts, answers):
+    with flask_app.app_context():
+        agent = Agent.query.filter_by(name=agent_name).first()
+        if not agent or instructions_hash(agent.instructions) != used_instructions_hash:
+            return False
+        if agent.embeddings_status == "I" or sorted(agent.suggested_prompts or []) != sorted(used_prompts):
+            return False
+        agent.suggested_answers = {"instructions_hash": used_instructions_hash, "answers": answers}
+        db.session.commit()
+        agent_cache.cache.invalidate(agent_name)
+        return True
+
+# Helper function to tell whether a chat turn is the first one: nothing but the agent's own welcome message before
+# it. The history comes from the client, so any other message (even a system one) could steer an answer that
+# would then be served to every user of the agent.
+def is_first_turn(agent, data: ChatRequest):
+    history = normalize_history(data.messages)
+    return not history or (len(history) == 1 and history[0]["content"] == agent["welcome_message"])
+
+# Helper function to look up the cached answer of a first turn on an agent with the answer cache on.
+# Returns (answer, key) where key is what store_answer needs to cache the answer of a miss (None when not cacheable).
+async def lookup_answer(agent, data: ChatRequest):
+    if not agent["answer_cache"] or not is_first_turn(agent, data):
+        return None, None
+    try:
+        response = await upstream.embeddings.request("POST", "/embed", idempotent=True,
+                                                     json={"agent_name": agent["name"], "prompt": data.input})
+        response.raise_for_status()
+        result = response.json()
+    except Exception as e:
+        # The answer cache is an optimization: without the embedding the turn is simply answered
+        print(f"Answer cache lookup failed for agent {agent['name']}: {str(e)}")
+        return None, None
+    fingerprint = (instructions_hash(agent["instructions"]), result["model"], result["index_version"], llm.pool.model)
+    key = (result["embedding"], fingerprint)
+    answer = answer_cache.cache.lookup(agent["name"], *key)
+    metrics.increment('answer_cache_hits' if answer is not None else 'answer_cache_misses')
+    return answer, key
+
+# Helper function to cache the answer of a first turn
+def store_answer(agent, key, answer):
+    if key is not None and answer:
+        answer_cache.cache.store(agent["name"], *key, answer)
+
+# Number of precomputes started per agent: only the latest one of an agent saves its answers, so a precompute
+# that began before the agent's documents were indexed again never overwrites the answers from the new index
+_precompute_runs = {}
+
+# Precompute the answers to the suggested prompts of an agent (one at a time, to leave the LLM to the users)
+async def precompute_suggested_answers(agent_name):
+    run = _precompute_runs[agent_name] = _precompute_runs.get(agent_name, 0) + 1
+    agent = await find_agent(agent_name)
+    if not agent:
+        return
+    used_instructions_hash = instructions_hash(agent["instructions"])
+    answers = {}
+    for prompt in agent["suggested_prompts"]:
+        try:
+            # wait for a turn of the LLM like the chat requests of the agent
+            slot = await scheduler.acquire(agent_name)
+            try:
+                messages, _ = await prepare_chat(agent, ChatRequest(input=prompt))
+                answers[normalize_prompt(prompt)] = (await llm.pool.complete(messages))["content"]
+            finally:
+                slot.release()
+        except Exception as e:
+            print(f"Error precomputing the answer to a suggested prompt of agent {agent_name}: {str(e)}")
+    if _precompute_runs.get(agent_name) != run:
+        return
+    if await asyncio.to_thread(save_suggested_answers, agent_name, used_instructions_hash, agent["suggested_prompts"], answers):
+        metrics.increment('suggested_answers_precomputed', len(answers))
+
+# Start precomputing the answers to the suggested prompts of an agent (called from the Flask threads)
+def schedule_suggested_answers(agent_name):
+    if loop is None:
+        print(f"Suggested answers of agent {agent_name} not precomputed: the app is not served by asgi.py")
+        return
+    asyncio.run_coroutine_threadsafe(precompute_suggested_answers(agent_name), loop)
+
+# Helper function to get the precomputed answer to a suggested prompt, or None. The answers were generated
+# without any history, so they only answer the first turn of a conversation.
+def suggested_answer(agent, data: ChatRequest):
+    if not is_first_turn(agent, data):
+        return None
+    answer = agent["suggested_answers"].get(normalize_prompt(data.input))
+    if answer is not None:
+        metrics.increment('suggested_answer_hits')
+    return answer
+
+# Helper function to get the session of a chat turn: the history of a known session replaces the messages sent,
+# otherwise a session is started with them. Returns the session id, or None if the session sent has expired.
+def resolve_session(agent_name, data: ChatRequest):
+    if data.session_id:
+        history = sessions.store.history(data.session_id, agent_name)
+        if history is None:
+            return None
+        data.messages = history
+        return data.session_id
+    return sessions.store.create(agent_name, data.messages)
+
+# Helper function to answer a request whose session has expired (the client sends the whole history again)
+def session_expired():
+    return JSONResponse(status_code=409, content={"msg": "Chat session expired, send the messages to start a new one"})
+
+# Helper function to format a server-sent event
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Helper function to retrieve the document chunks for a chat turn and compose the LLM request
+async def prepare_chat(agent, data: ChatRequest):
+    # Call the embeddings server to query for document chunks
+    # Ask for the top chunks above a similarity cutoff, without near-duplicates and within a token budget
+    query = {
+        "agent_name": agent["name"],
+        "prompt": data.input,
+        "top_k": Config.RETRIEVAL_TOP_K,
+        "min_similarity": Config.RETRIEVAL_MIN_SIMILARITY,
+        "dedup_threshold": Config.RETRIEVAL_DEDUP_THRESHOLD,
+        "mmr_lambda": Config.RETRIEVAL_MMR_LAMBDA,
+        "token_budget": Config.RETRIEVAL_TOKEN_BUDGET
+    }
+    # The query only reads the index, so it is retried like an idempotent call
+    response = await upstream.embeddings.request("POST", "/query", idempotent=True, json=query)
+    # An agent without embeddings (404) is answered without document chunks
+    document_chunks = []
+    if response.status_code != 404:
+        response.raise_for_status()
+        document_chunks = response.json()['results']
+    document_text_array = [chunk.replace('\n', ' ') for sublist in document_chunks for chunk in sublist]
+
+    # compose request within the model's context budget
+    return compose_request(
+        agent["instructions"], document_text_array, data.messages, data.input, llm.pool.model,
+        default_context_tokens=Config.LLM_CONTEXT_TOKENS, response_tokens=Config.LLM_RESPONSE_TOKENS,
+        summary_tokens=Config.HISTORY_SUMMARY_TOKENS, chars_per_token=Config.CHARS_PER_TOKEN)
+
+@router.post("/api/chat/{agent_name}")
+async def chat_completion(agent_name: str, data: ChatRequest):
+    started_at = time.perf_counter()
+    try:
+        # Find the agent by name
+        agent = await find_agent(agent_name)
+        if not agent:
+            return JSONResponse(status_code=404, content={"msg": "Agent not found"})
+        # get the history from the session
+        session_id = resolve_session(agent_name, data)
+        if session_id is None:
+            return session_expired()
+
+        # answer from the precomputed answers of the suggested prompts, or from the cache when the same
+        # question was answered before
+        answer, answer_key = suggested_answer(agent, data), None
+        if answer is None:
+            answer, answer_key = await lookup_answer(agent, data)
+        if answer is not None:
+            sessions.store.append(session_id, data.input, answer)
+            return {"success": True, "content": answer, "role": "assistant", "prompt_tokens": 0, "cached": True, "session_id": session_id}
+
+        # wait for a turn of the LLM (503 when the agent's queue is full or the wait too long)
+        slot = await scheduler.acquire(agent_name)
+        try:
+            # retrieve document chunks and compose request
+            messages, prompt_tokens = await prepare_chat(agent, data)
+
+            # call LLM server
+            llm_response = await llm.pool.complete(messages)
+        finally:
+            slot.release()
+        metrics.observe('chat_completion_total', (time.perf_counter() - started_at) * 1000)
+        store_answer(agent, answer_key, llm_response["content"])
+        sessions.store.append(session_id, data.input, llm_response["content"])
+
+        # return to browser
+        return {"success": True, "content": llm_response["content"], "role": llm_response["role"], "prompt_tokens": prompt_tokens,
+                "session_id": session_id}
+    except Overloaded:
+        raise
+    except Exception as e:
+        return {"success": False, "content": str(e), "role": "assistant"}
+
+# POST method streaming the chat completion to the browser as server-sent events
+@router.post("/api/chat/{agent_name}/stream")
+async def chat_completion_stream(agent_name: str, data: ChatRequest):
+    started_at = time.perf_counter()
+    # Find the agent by name
+    agent = await find_agent(agent_name)
+    if not agent:
+        return JSONResponse(status_code=404, content={"msg": "Agent not found"})
+    # get the history from the session
+    session_id = resolve_session(agent_name, data)
+    if session_id is None:
+        return session_expired()
+
+    # Disable proxy buffering so each event reaches the browser as soon as it is sent
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    # answer from the precomputed answers of the suggested prompts, or from the cache when the same
+    # question was answered before
+    answer, answer_key = suggested_answer(agent, data), None
+    if answer is None:
+        answer, answer_key = await lookup_answer(agent, data)
+    if answer is not None:
+        sessions.store.append(session_id, data.input, answer)
+
+        async def cached():
+            yield sse_event({"content": answer, "role": "assistant"})
+            yield sse_event({"success": True, "prompt_tokens": 0, "cached": True, "session_id": session_id,
+                             "total_ms": round((time.perf_counter() - started_at) * 1000, 1)}, event="done")
+
+        return StreamingResponse(cached(), media_type="text/event-stream", headers=headers)
+
+    # wait for a turn of the LLM before the response starts (503 when the agent's queue is full or the wait too long)
+    slot = await scheduler.acquire(agent_name)
+
+    async def generate():
+        try:
+            # retrieve document chunks and compose request
+            messages, prompt_tokens = await prepare_chat(agent, data)
+
+            # relay the tokens as they are generated, tracking the time to first token
+            first_token_ms = None
+            contents = []
+            async for content in llm.pool.stream(messages):
+                if first_token_ms is None:
+                    first_token_ms = (time.perf_counter() - started_at) * 1000
+                    metrics.observe('chat_time_to_first_token', first_token_ms)
+                contents.append(content)
+                yield sse_event({"content": content, "role": "assistant"})
+            slot.release()
+
+            total_ms = (time.perf_counter() - started_at) * 1000
+            metrics.observe('chat_stream_total', total_ms)
+            store_answer(agent, answer_key, "".join(contents))
+            sessions.store.append(session_id, data.input, "".join(contents))
+            yield sse_event({"success": True, "prompt_tokens": prompt_tokens, "session_id": session_id,
+                             "time_to_first_token_ms": round(first_token_ms, 1) if first_token_ms else None,
+                             "total_ms": round(total_ms, 1)}, event="done")
+        except Exception as e:
+            metrics.increment('chat_stream_errors')
+            yield sse_event({"success": False, "content": str(e), "role": "assistant", "session_id": session_id}, event="error")
+        finally:
+            slot.release()
+
+    # The turn is also released after the response, in case the client left before the stream started
+    return StreamingResponse(generate(), media_type="text/event-stream", headers=headers, background=BackgroundTask(slot.release))
@@ -20,5 +20,42 @@ class Config:
     HEADER_KEY = 'XteNATqxnbBkPa6TCHcK0NTxOM1JVkQl' # this key cannot be changed because it is sent from the react frontend
     LLM_SERVER_PORT = os.getenv('LLM_SERVER_PORT', 8001)
     EMBEDDINGS_SERVER_PORT = os.getenv('EMBEDDINGS_SERVER_PORT', 8000)
+    RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', 5)) # maximum document chunks added to a chat prompt
+    RETRIEVAL_MIN_SIMILARITY = float(os.getenv('RETRIEVAL_MIN_SIMILARITY', 0.2)) # chunks less similar to the prompt are left out
+    RETRIEVAL_DEDUP_THRESHOLD = float(os.getenv('RETRIEVAL_DEDUP_THRESHOLD', 0.95)) # chunks this similar to a selected one are left out
+    RETRIEVAL_MMR_LAMBDA = float(os.getenv('RETRIEVAL_MMR_LAMBDA', 0.7)) # relevance / diversity trade-off, 1.0 keeps the order of relevance
+    RETRIEVAL_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', 1500)) # maximum tokens of the document chunks in a chat prompt
+    EMBEDDINGS_JOB_POLL_SECONDS = float(os.getenv('EMBEDDINGS_JOB_POLL_SECONDS', 2)) # how often an embeddings job is checked for completion
+    EMBEDDINGS_JOB_POLL_MAX_SECONDS = float(os.getenv('EMBEDDINGS_JOB_POLL_MAX_SECONDS', 60)) # longest wait between checks while the embeddings server cannot be reached
     OPENAPI_KEY = os.getenv('OPENAPI_KEY', 'None')
-    LLM_MODEL_NAME = os.getenv('LLM_MODEL_NAME')
\ No newline at end of file
+    LLM_MODEL_NAME = os.getenv('LLM_MODEL_NAME')
+    OLLAMA_MODEL_NAME = os.getenv('OLLAMA_MODEL_NAME', 'phi3')
+    LLM_CONTEXT_TOKENS = int(os.getenv('LLM_CONTEXT_TOKENS', 4096)) # context window of models not listed in prompts.py
+    LLM_RESPONSE_TOKENS = int(os.getenv('LLM_RESPONSE_TOKENS', 512)) # tokens of the context window kept free for the answer
+    HISTORY_SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', 256)) # maximum tokens of the summary of older turns
+    CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', 4)) # used to estimate token counts
+    LLM_TIMEOUT_SECONDS = float(os.getenv('LLM_TIMEOUT_SECONDS', 600)) # maximum time to wait on the LLM server
+    EMBEDDINGS_TIMEOUT_SECONDS = float(os.getenv('EMBEDDINGS_TIMEOUT_SECONDS', 30)) # maximum time to wait on an embeddings query
+    UPSTREAM_CONNECT_TIMEOUT_SECONDS = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT_SECONDS', 10)) # maximum time to connect to the embeddings or LLM server
+    UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', 100)) # connections kept open to the embeddings and LLM servers
+    WSGI_THREADS = int(os.getenv('WSGI_THREADS', 10)) # threads serving the Flask routes under the ASGI server
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2)) # retries of a failed idempotent call to the embeddings or LLM server
+    UPSTREAM_RETRY_BACKOFF_SECONDS = float(os.getenv('UPSTREAM_RETRY_BACKOFF_SECONDS', 0.2)) # wait before the first retry, doubled for each one after
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)) # consecutive failures after which calls to a server fail fast
+    CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', 30)) # how long calls fail fast before one is let through again
+    LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'ollama') # ollama, or openai for vLLM and other OpenAI-compatible servers
+    LLM_SERVER_URLS = os.getenv('LLM_SERVER_URLS', '') # comma-separated base URLs of the LLM server replicas, defaults to the llm-server service
+    LLM_HEALTH_CHECK_SECONDS = float(os.getenv('LLM_HEALTH_CHECK_SECONDS', 10)) # how often the LLM server replicas are checked
+    ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 256)) # answers to first chat turns kept per agent (for agents with the answer cache on)
+    ANSWER_CACHE_MIN_SIMILARITY = float(os.getenv('ANSWER_CACHE_MIN_SIMILARITY', 0.95)) # prompts at least this similar to an answered one get its answer
+    CHAT_SESSION_MAX = int(os.getenv('CHAT_SESSION_MAX', 10000)) # chat sessions kept by the server, the least recently used are dropped
+    CHAT_SESSION_TTL_SECONDS = float(os.getenv('CHAT_SESSION_TTL_SECONDS', 1800)) # chat sessions without a turn for this long expire
+    CHAT_SESSION_MAX_MESSAGES = int(os.getenv('CHAT_SESSION_MAX_MESSAGES', 100)) # messages kept per chat session
+    LLM_MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', 8)) # chat requests using the LLM servers at once, the others wait in their agent's queue
+    LLM_MAX_QUEUE_PER_AGENT = int(os.getenv('LLM_MAX_QUEUE_PER_AGENT', 16)) # chat requests of one agent waiting for the LLM before new ones get 503
+    LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 128)) # chat requests of all agents waiting for the LLM before new ones get 503
+    LLM_MAX_QUEUE_WAIT_SECONDS = float(os.getenv('LLM_MAX_QUEUE_WAIT_SECONDS', 60)) # chat requests waiting longer for the LLM get 503
+    LLM_RETRY_AFTER_SECONDS = int(os.getenv('LLM_RETRY_AFTER_SECONDS', 10)) # Retry-After sent with the 503 of a rejected chat request
+    AGENT_CACHE_SIZE = int(os.getenv('AGENT_CACHE_SIZE', 1000)) # agents whose chat metadata is kept in memory
+    AGENTS_PAGE_MAX_SIZE = int(os.getenv('AGENTS_PAGE_MAX_SIZE', 100)) # largest page of the agents list
+    AGENT_FILES_PAGE_MAX_SIZE = int(os.getenv('AGENT_FILES_PAGE_MAX_SIZE', 500)) # largest page of an agent's files list
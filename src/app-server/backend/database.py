@@ -1,8 +1,19 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import DeclarativeBase
 
 class Base(DeclarativeBase):
   pass
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+# Add the columns of a model that its existing table does not have yet (create_all only creates missing tables)
+def add_missing_columns(model):
+    table = model.__table__
+    existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
@@ -0,0 +1,157 @@
+import asyncio
+import json
+import random
+import httpx
+from config import Config
+import upstream
+
+# LLM providers: how to call one kind of model server
+class OllamaProvider:
+    name = "ollama"
+    default_url = "http://llm-server:11434"
+    chat_path = "/api/chat"
+    health_path = "/api/tags"
+
+    def payload(self, model, messages, stream):
+        return {"model": model, "messages": messages, "stream": stream}
+
+    def parse_response(self, data):
+        message = data['message']
+        return {"content": message['content'], "role": message['role']}
+
+    # Ollama sends one JSON object per line, the last one with "done": true. Returns (content, done).
+    def parse_stream_line(self, line):
+        if not line:
+            return None, False
+        chunk = json.loads(line)
+        return chunk.get('message', {}).get('content'), bool(chunk.get('done'))
+
+class OpenAIProvider:
+    name = "openai"
+    default_url = f"http://llm-server:{Config.LLM_SERVER_PORT}/v1"
+    chat_path = "/chat/completions"
+    health_path = "/models"
+
+    def payload(self, model, messages, stream):
+        return {"model": model, "messages": messages, "stream": stream}
+
+    def parse_response(self, data):
+        message = data['choices'][0]['message']
+        return {"content": message['content'], "role": message['role']}
+
+    # The OpenAI-compatible API (vLLM) sends server-sent events: "data: {...}" lines ending with "data: [DONE]"
+    def parse_stream_line(self, line):
+        if not line or not line.startswith("data:"):
+            return None, False
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return None, True
+        return json.loads(payload)['choices'][0].get('delta', {}).get('content'), False
+
+PROVIDERS = {"ollama": OllamaProvider, "openai": OpenAIProvider, "vllm": OpenAIProvider}
+
+# One model server replica with its pooled client and the number of requests it is serving
+class Replica:
+    def __init__(self, name, url):
+        self.url = url
+        self.upstream = upstream.create_upstream(name, url, Config.LLM_TIMEOUT_SECONDS)
+        self.outstanding = 0
+        self.healthy = True
+
+    # Helper function to tell whether the replica should be avoided
+    def unavailable(self):
+        return not self.healthy or self.upstream.breaker.state() == "open"
+
+    def stats(self):
+        return {"url": self.url, "healthy": self.healthy, "outstanding": self.outstanding}
+
+# The model server replicas of one provider. Every request goes to the available replica serving the fewest
+# requests; a replica whose connection fails is skipped for the next one. A background task checks the health
+# of every replica so that a replica that is down is left out before requests fail on it.
+class LLMPool:
+    def __init__(self, provider, model, urls):
+        self.provider = provider
+        self.model = model
+        self.replicas = [Replica(f"{provider.name}-{i}", url) for i, url in enumerate(urls)]
+
+    # Helper function to order the replicas to try: available ones first, then by outstanding requests
+    # (ties broken at random so that idle replicas share the load)
+    def candidates(self):
+        return sorted(self.replicas, key=lambda replica: (replica.unavailable(), replica.outstanding, random.random()))
+
+    # Helper function to tell whether a failed call may be sent to the next replica (nothing was generated yet)
+    @staticmethod
+    def can_fail_over(error):
+        return isinstance(error, (upstream.CircuitOpen, httpx.ConnectError, httpx.ConnectTimeout))
+
+    # Send a chat completion and return the message
+    async def complete(self, messages):
+        last_error = None
+        for replica in self.candidates():
+            replica.outstanding += 1
+            try:
+                response = await replica.upstream.request("POST", self.provider.chat_path,
+                                                          json=self.provider.payload(self.model, messages, False))
+                response.raise_for_status()
+                return self.provider.parse_response(response.json())
+            except Exception as e:
+                if not self.can_fail_over(e):
+                    raise
+                last_error = e
+            finally:
+                replica.outstanding -= 1
+        raise last_error
+
+    # Stream a chat completion, yielding the content as it is generated
+    async def stream(self, messages):
+        last_error = None
+        for replica in self.candidates():
+            replica.outstanding += 1
+            try:
+                async with replica.upstream.stream("POST", self.provider.chat_path,
+                                                   json=self.provider.payload(self.model, messages, True)) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        content, done = self.provider.parse_stream_line(line)
+                        if content:
+                            yield content
+                        if done:
+                            break
+                return
+            except Exception as e:
+                if not self.can_fail_over(e):
+                    raise
+                last_error = e
+            finally:
+                replica.outstanding -= 1
+        raise last_error
+
+    # Check the health of every replica
+    async def check_health(self):
+        async def check(replica):
+            try:
+                response = await replica.upstream.client.get(self.provider.health_path, timeout=Config.UPSTREAM_CONNECT_TIMEOUT_SECONDS)
+                replica.healthy = response.status_code < 500
+            except httpx.HTTPError:
+                replica.healthy = False
+        await asyncio.gather(*(check(replica) for replica in self.replicas))
+
+    # Check the health of every replica periodically (runs for the life of the ASGI app)
+    async def run_health_checks(self, interval):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        return {"provider": self.provider.name, "model": self.model, "replicas": [replica.stats() for replica in self.replicas]}
+
+# Helper function to create the pool configured in the environment
+def create_pool():
+    if Config.LLM_PROVIDER not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER {Config.LLM_PROVIDER}, expected one of {', '.join(PROVIDERS)}")
+    provider = PROVIDERS[Config.LLM_PROVIDER]()
+    model = Config.OLLAMA_MODEL_NAME if provider.name == "ollama" else Config.LLM_MODEL_NAME
+    urls = [url.strip().rstrip("/") for url in Config.LLM_SERVER_URLS.split(",") if url.strip()] or [provider.default_url]
+    return LLMPool(provider, model, urls)
+
+pool = create_pool()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from config import Config
+
+# Load test of the chat path of a running app server:
+#   python loadtest.py --url http://localhost:8080 --agent myagent --concurrency 32 --requests 128
+# Sends chats from many concurrent users over the streaming route and, at the same time, probes a cheap route
+# (the chat widget's agent details) to see whether other users are stalled while generations are in flight.
+# Run it at the same --concurrency against the previous WSGI deployment (gunicorn, one worker) and the ASGI server
+# (uvicorn asgi:app), then compare chats_per_second and the p50 / p99 of chat_total and probe_latency.
+# No such run has been recorded yet, so whether the ASGI path raises concurrency under load is still to be measured.
+
+# Helper function to summarize a list of timings in ms
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(values[int(len(values) * 0.5)], 1),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))], 1),
+        "max_ms": round(values[-1], 1),
+    }
+
+# Helper function to run one chat over the streaming route, returning (time to first token, total time) in ms
+async def run_chat(client: httpx.AsyncClient, url: str, agent: str, prompt: str):
+    started_at = time.perf_counter()
+    first_token_ms = None
+    async with client.stream("POST", f"{url}/api/chat/{agent}/stream", json={"input": prompt, "messages": []}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("event: error"):
+                raise Exception("chat failed")
+            if first_token_ms is None and line.startswith("data:") and "content" in json.loads(line[5:]):
+                first_token_ms = (time.perf_counter() - started_at) * 1000
+    return first_token_ms, (time.perf_counter() - started_at) * 1000
+
+# Helper function to keep probing a cheap route until stopped, collecting the latencies
+async def run_probes(client: httpx.AsyncClient, url: str, agent: str, interval: float, stop: asyncio.Event, latencies: list):
+    headers = {"X-Requested-With": Config.HEADER_KEY}
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await client.get(f"{url}/api/chat/{agent}", headers=headers)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        await asyncio.sleep(interval)
+
+async def main(args):
+    first_token_times, total_times, probe_times = [], [], []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        async def one_chat(i):
+            nonlocal errors
+            async with semaphore:
+                try:
+                    first_token_ms, total_ms = await run_chat(client, args.url, args.agent, f"{args.prompt} ({i})")
+                    if first_token_ms is not None:
+                        first_token_times.append(first_token_ms)
+                    total_times.append(total_ms)
+                except Exception:
+                    errors += 1
+
+        stop = asyncio.Event()
+        probes = asyncio.create_task(run_probes(client, args.url, args.agent, args.probe_interval, stop, probe_times))
+        started_at = time.perf_counter()
+        await asyncio.gather(*(one_chat(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - started_at
+        stop.set()
+        await probes
+
+    print("chats", {"completed": len(total_times), "errors": errors, "chats_per_second": round(len(total_times) / elapsed, 2)})
+    print("time_to_first_token", summarize(first_token_times))
+    print("chat_total", summarize(total_times))
+    print("probe_latency", summarize(probe_times))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how many concurrent chats the app server sustains")
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--agent", required=True)
+    parser.add_argument("--prompt", default="What is this agent about?")
+    parser.add_argument("--concurrency", type=int, default=32, help="number of chats in flight at once")
+    parser.add_argument("--requests", type=int, default=128, help="total number of chats")
+    parser.add_argument("--probe-interval", type=float, default=0.5, help="seconds between probes of the agent details route")
+    parser.add_argument("--timeout", type=float, default=Config.LLM_TIMEOUT_SECONDS)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,42 @@
+import threading
+from collections import deque
+
+# In-process metrics of the app server: counters and timings (count, mean and percentiles over recent samples)
+_counters = {}
+_timings = {}
+_lock = threading.Lock()
+_SAMPLES_KEPT = 1000
+
+# Add n to a counter
+def increment(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+# Record a timing in milliseconds
+def observe(name, value_ms):
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "samples": deque(maxlen=_SAMPLES_KEPT)})
+        timing["count"] += 1
+        timing["total"] += value_ms
+        timing["samples"].append(value_ms)
+
+# Helper function to get a percentile of a sorted list
+def _percentile(values, percent):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * percent / 100))], 2)
+
+# Get all counters and timing summaries
+def snapshot():
+    with _lock:
+        timings = {}
+        for name, timing in _timings.items():
+            samples = sorted(timing["samples"])
+            timings[name] = {
+                "count": timing["count"],
+                "mean_ms": round(timing["total"] / timing["count"], 2),
+                "p50_ms": _percentile(samples, 50),
+                "p95_ms": _percentile(samples, 95),
+                "p99_ms": _percentile(samples, 99),
+            }
+        return {"counters": dict(_counters), "timings": timings}
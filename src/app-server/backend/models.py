@@ -1,5 +1,5 @@
 from database import db
-from sqlalchemy import Column, String, Integer, DateTime, JSON
+from sqlalchemy import Column, String, Integer, DateTime, JSON, Boolean, ForeignKey, UniqueConstraint
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -18,8 +18,25 @@ class Agent(db.Model):
     instructions = Column(String, nullable=True)
     welcome_message = Column(String, nullable=True)
     suggested_prompts = Column(JSON, nullable=True)
-    files = Column(JSON, nullable=True) 
+    files = Column(JSON, nullable=True)  # legacy list of filenames, moved to agent_files on startup
     status = Column(String, nullable=True) 
     embeddings_status = Column(String, nullable=True) 
+    answer_cache = Column(Boolean, nullable=True)  # reuse the answers to first chat turns with near-identical prompts
+    suggested_answers = Column(JSON, nullable=True)  # precomputed answers to the suggested prompts
     created_at = Column(DateTime(timezone=True))
-    updated_at = Column(DateTime(timezone=True))
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True))
+
+class AgentFile(db.Model):
+    __tablename__ = "agent_files"
+    __table_args__ = (UniqueConstraint('agent_id', 'filename'),)
+
+    id = Column(Integer, primary_key=True, index=True, nullable=False)
+    agent_id = Column(Integer, ForeignKey('agents.id'), index=True, nullable=False)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)  # bytes
+    content_hash = Column(String, nullable=True)  # sha256 of the content, as in the embeddings manifest
+    mtime = Column(DateTime(timezone=True), nullable=True)
+    embeddings_status = Column(String, nullable=True)  # "I" in progress, "E" failed, "" done
+    chunks = Column(Integer, nullable=True)  # chunks embedded for the file
+    created_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True))
@@ -0,0 +1,157 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+# Context window (in tokens) of the models we serve; models not listed use the default passed in
+MODEL_CONTEXT_TOKENS = {
+    "phi3": 4096,
+    "microsoft/Phi-3-mini-4k-instruct": 4096,
+    "microsoft/Phi-3-mini-128k-instruct": 131072,
+}
+
+# Helper function to hash the instructions of an agent (answers given with other instructions are not reused)
+def instructions_hash(instructions):
+    return hashlib.sha256((instructions or "").encode("utf-8")).hexdigest()
+
+# Helper function to normalize a prompt so that trivially different spellings match
+def normalize_prompt(prompt):
+    return " ".join(prompt.split())
+
+# Tokens assumed per message for the role and chat template markers
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Helper function to estimate the tokens of a text. The LLM's tokenizer is not available in the app server,
+# so this uses the usual ~4 characters per token of English text, rounded up to stay on the safe side.
+def estimate_tokens(text, chars_per_token=4.0):
+    return math.ceil(len(text or "") / chars_per_token)
+
+# Helper function to estimate the tokens of a list of messages
+def estimate_messages_tokens(messages, chars_per_token=4.0):
+    return sum(estimate_tokens(message["content"], chars_per_token) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+# Helper function to get the context budget of a model
+def context_budget(model, default_tokens):
+    return MODEL_CONTEXT_TOKENS.get(model, default_tokens)
+
+# Helper function to turn the client's history into a list of {"role", "content"} messages.
+# Both the chat widget format ({"role": ..., "content": ...}) and the {"user": ..., "assistant": ...} format are accepted.
+def normalize_history(history):
+    messages = []
+    for entry in history or []:
+        if "role" in entry and "content" in entry:
+            messages.append({"role": entry["role"], "content": entry["content"]})
+            continue
+        for role in ("user", "assistant", "system"):
+            if role in entry:
+                messages.append({"role": role, "content": entry[role]})
+    return [message for message in messages if message["content"]]
+
+# Cache of the one-line summaries of conversation turns, keyed by a hash of the turn
+_summary_lines = OrderedDict()
+_summary_lock = threading.Lock()
+_SUMMARY_CACHE_SIZE = 10000
+
+# Helper function to summarize a turn as one line (its first sentence, shortened), cached across requests
+def summarize_turn(message, max_chars=200):
+    key = hashlib.sha256(f"{message['role']}\n{message['content']}".encode("utf-8")).hexdigest()
+    with _summary_lock:
+        line = _summary_lines.get(key)
+        if line is not None:
+            _summary_lines.move_to_end(key)
+            return line
+
+    text = " ".join(message["content"].split())
+    first_sentence = re.split(r'(?<=[.!?])\s', text, maxsplit=1)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars].rstrip() + "..."
+    speaker = "User" if message["role"] == "user" else "Assistant"
+    line = f"{speaker}: {first_sentence}"
+
+    with _summary_lock:
+        _summary_lines[key] = line
+        while len(_summary_lines) > _SUMMARY_CACHE_SIZE:
+            _summary_lines.popitem(last=False)
+    return line
+
+# Helper function to fold older turns into a running summary that fits the given budget (most recent lines kept)
+def summarize_turns(messages, budget_tokens, chars_per_token=4.0):
+    lines = []
+    used = 0
+    for message in reversed(messages):
+        line = summarize_turn(message)
+        tokens = estimate_tokens(line, chars_per_token) + 1
+        if used + tokens > budget_tokens:
+            break
+        lines.insert(0, line)
+        used += tokens
+    return "\n".join(lines)
+
+# Helper function to compose the LLM request within the model's context budget
+def compose_request(instruction, document_chunks, history, user_prompt, model, default_context_tokens=4096,
+                    response_tokens=512, summary_tokens=256, chars_per_token=4.0):
+    """
+    Combines the instruction, document chunks, history, and user prompt into a complete prompt
+    for an LLM (vLLM, Ollama, or OpenAI-compatible API) that fits the model's context window.
+
+    The instruction and the user prompt are always kept. Document chunks are kept in order of relevance
+    while they fit. The remaining budget goes to the most recent turns of the history; older turns are
+    folded into a running summary (one cached line per turn) sent as a system message.
+
+    :param instruction: The main system instruction to the LLM (e.g., "You are a Teacher...").
+    :param document_chunks: A list of document chunks relevant to the conversation, most relevant first.
+    :param history: A list of past user prompts and system responses (as a list of dictionaries).
+    :param user_prompt: The latest user input or question.
+    :param model: The name of the model, used to look up its context window.
+    :param default_context_tokens: The context window of models not listed in MODEL_CONTEXT_TOKENS.
+    :param response_tokens: The tokens kept free for the model's answer.
+    :param summary_tokens: The maximum tokens of the summary of older turns.
+    :param chars_per_token: The characters per token used to estimate token counts.
+
+    :return: A tuple (messages, prompt_tokens) with the formatted list of messages to be used for the
+             LLM completion API and the estimated number of tokens they take.
+    """
+    budget = context_budget(model, default_context_tokens) - response_tokens
+
+    # Start with the instruction as the system message and end with the latest user prompt
+    head = [{"role": "system", "content": instruction or ""}]
+    tail = [{"role": "user", "content": user_prompt}]
+    remaining = budget - estimate_messages_tokens(head + tail, chars_per_token)
+
+    # Add document chunks as a system message (summarizing or presenting document context), as many as fit
+    if document_chunks:
+        kept_chunks = []
+        header = "The following document chunks are relevant:\n"
+        used = estimate_tokens(header, chars_per_token) + MESSAGE_OVERHEAD_TOKENS
+        for chunk in document_chunks:
+            tokens = estimate_tokens(chunk + "\n\n", chars_per_token)
+            if used + tokens > remaining:
+                break
+            kept_chunks.append(chunk)
+            used += tokens
+        if kept_chunks:
+            head.append({"role": "system", "content": header + "\n\n".join(kept_chunks)})
+            remaining -= used
+
+    # Add the most recent turns of the history that fit, keeping room for the summary of the older ones
+    turns = normalize_history(history)
+    recent = []
+    used = 0
+    for index in range(len(turns) - 1, -1, -1):
+        tokens = estimate_tokens(turns[index]["content"], chars_per_token) + MESSAGE_OVERHEAD_TOKENS
+        reserve = summary_tokens if index > 0 else 0
+        if used + tokens + reserve > remaining:
+            break
+        recent.insert(0, turns[index])
+        used += tokens
+    older = turns[:len(turns) - len(recent)]
+
+    # Fold the older turns into a running summary
+    if older:
+        summary = summarize_turns(older, min(summary_tokens, remaining - used) - MESSAGE_OVERHEAD_TOKENS, chars_per_token)
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+
+    messages = head + recent + tail
+    return messages, estimate_messages_tokens(messages, chars_per_token)
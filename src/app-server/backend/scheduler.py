@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from config import Config
+import metrics
+
+class Overloaded(Exception):
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+# A turn of the LLM held by a request; released once, whichever of its owners gets there first
+class Slot:
+    def __init__(self, scheduler, agent_name):
+        self._scheduler = scheduler
+        self.agent_name = agent_name
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self.agent_name)
+
+# Admission control in front of the LLM: at most max_concurrent requests use the LLM at once. The others wait in
+# one queue per agent, and a freed turn goes to the agents in round-robin order, so a burst on one agent only
+# delays that agent. A request is rejected when its agent's queue (or all queues together) is full, or when it
+# waited longer than max_wait_seconds.
+class FairScheduler:
+    def __init__(self, max_concurrent: int, max_queue_per_agent: int, max_queue: int, max_wait_seconds: float,
+                 retry_after: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue_per_agent = max_queue_per_agent
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.retry_after = retry_after
+        self._running = 0
+        self._queued = 0
+        self._waiters = OrderedDict()  # agent_name -> deque of futures, in round-robin order
+        self._agents = {}  # agent_name -> counters
+
+    # Helper function to get the counters of an agent
+    def _agent(self, agent_name):
+        return self._agents.setdefault(agent_name, {"running": 0, "admitted": 0, "rejected": 0})
+
+    # Helper function to reject a request
+    def _reject(self, agent_name, detail):
+        self._agent(agent_name)["rejected"] += 1
+        metrics.increment('llm_requests_rejected')
+        raise Overloaded(detail, self.retry_after)
+
+    # Helper function to give a turn to an agent
+    def _start(self, agent_name):
+        self._running += 1
+        self._agent(agent_name)["running"] += 1
+
+    # Helper function to count a request that got its turn
+    def _admitted(self, agent_name, waited_ms):
+        self._agent(agent_name)["admitted"] += 1
+        metrics.observe(f'llm_queue_wait:{agent_name}', waited_ms)
+
+    # Wait for a turn of the LLM, returning the Slot to release when done
+    async def acquire(self, agent_name: str):
+        if self._running < self.max_concurrent and not self._queued:
+            self._start(agent_name)
+            self._admitted(agent_name, 0)
+            return Slot(self, agent_name)
+
+        waiters = self._waiters.get(agent_name)
+        if self._queued >= self.max_queue:
+            self._reject(agent_name, "The LLM server is busy, retry later")
+        if waiters is not None and len(waiters) >= self.max_queue_per_agent:
+            self._reject(agent_name, f"Too many requests waiting for agent {agent_name}, retry later")
+
+        started_at = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(agent_name, deque()).append(future)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The turn was given just as the wait ended: hand it on
+                self._release(agent_name)
+            else:
+                future.cancel()
+                self._remove_waiter(agent_name, future)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject(agent_name, "The LLM server is busy, retry later")
+        self._admitted(agent_name, (time.perf_counter() - started_at) * 1000)
+        return Slot(self, agent_name)
+
+    # Helper function to take a request out of its agent's queue
+    def _remove_waiter(self, agent_name, future):
+        waiters = self._waiters.get(agent_name)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self._queued -= 1
+            if not waiters:
+                del self._waiters[agent_name]
+
+    # Helper function to free a turn and give it to the next agent in round-robin order
+    def _release(self, agent_name):
+        self._running -= 1
+        self._agent(agent_name)["running"] -= 1
+        while self._waiters and self._running < self.max_concurrent:
+            next_agent, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            self._queued -= 1
+            # The agent goes to the back of the round
+            del self._waiters[next_agent]
+            if waiters:
+                self._waiters[next_agent] = waiters
+            if not future.done():
+                self._start(next_agent)
+                future.set_result(None)
+
+    # Get the overall and per agent counters (called from the Flask threads, so the dicts are copied first)
+    def stats(self):
+        waiters = dict(self._waiters)
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "agents": {
+                agent_name: {**counters, "queued": len(waiters.get(agent_name, ()))}
+                for agent_name, counters in list(self._agents.items())
+            },
+        }
+
+scheduler = FairScheduler(Config.LLM_MAX_CONCURRENT, Config.LLM_MAX_QUEUE_PER_AGENT, Config.LLM_MAX_QUEUE,
+                          Config.LLM_MAX_QUEUE_WAIT_SECONDS, Config.LLM_RETRY_AFTER_SECONDS)
@@ -0,0 +1,74 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from prompts import normalize_history
+
+# Server-held chat sessions: the conversation of each chat widget is kept here, so that the client only sends the
+# new input with its session id. Sessions expire after ttl_seconds without a turn; when the store is full the
+# least recently used session is dropped. Each session keeps its last max_messages messages (older turns would
+# only be folded into the summary of the prompt).
+class SessionStore:
+    def __init__(self, max_sessions: int, ttl_seconds: float, max_messages: int):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()  # session_id -> {"agent_name", "messages", "expires_at"}
+        self._lock = threading.Lock()
+        self._expired = 0
+        self._evicted = 0
+
+    # Helper function to drop the expired sessions (the least recently used come first)
+    def _drop_expired(self, now):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session["expires_at"] > now:
+                break
+            del self._sessions[session_id]
+            self._expired += 1
+
+    # Start a session of an agent with the given history, returning its id
+    def create(self, agent_name: str, messages: list):
+        session_id = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            self._sessions[session_id] = {
+                "agent_name": agent_name,
+                "messages": normalize_history(messages)[-self.max_messages:],
+                "expires_at": now + self.ttl_seconds,
+            }
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self._evicted += 1
+        return session_id
+
+    # Get a copy of the history of a session of the agent, or None if the session is unknown or expired
+    def history(self, session_id: str, agent_name: str):
+        now = time.monotonic()
+        with self._lock:
+            self._drop_expired(now)
+            session = self._sessions.get(session_id)
+            if session is None or session["agent_name"] != agent_name:
+                return None
+            session["expires_at"] = now + self.ttl_seconds
+            self._sessions.move_to_end(session_id)
+            return list(session["messages"])
+
+    # Add a turn to a session
+    def append(self, session_id: str, user_input: str, answer: str):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session["messages"].extend([{"role": "user", "content": user_input}, {"role": "assistant", "content": answer}])
+            del session["messages"][:-self.max_messages]
+            session["expires_at"] = time.monotonic() + self.ttl_seconds
+            self._sessions.move_to_end(session_id)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "expired": self._expired, "evicted": self._evicted}
+
+store = SessionStore(Config.CHAT_SESSION_MAX, Config.CHAT_SESSION_TTL_SECONDS, Config.CHAT_SESSION_MAX_MESSAGES)
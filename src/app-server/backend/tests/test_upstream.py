@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sys
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+# The backend modules import each other by their flat names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATA_DIR', 'data')
+
+from upstream import CircuitBreaker, CircuitOpen, Upstream
+
+# Helper function to create an upstream that is never reached over the network
+def make_upstream(client, retries=0, failure_threshold=1, reset_seconds=0):
+    upstream = Upstream("test", "http://upstream.invalid", connect_timeout=1, read_timeout=1, retries=retries,
+                        retry_backoff=0, max_connections=1, failure_threshold=failure_threshold,
+                        reset_seconds=reset_seconds)
+    upstream._client = client
+    return upstream
+
+# Helper function to open the breaker of an upstream so that its next call is the half-open trial
+def open_breaker(upstream):
+    upstream.breaker.record_failure()
+    assert upstream.breaker.state() == "half_open"
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class HangingClient:
+    async def request(self, method, path, **kwargs):
+        await asyncio.Event().wait()
+
+class FailingSession:
+    def __init__(self, error, response):
+        self.error = error
+        self.response = response
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise self.error
+        return self.response
+
+class ScriptedClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    async def request(self, method, path, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+def test_cancelled_half_open_trial_is_released():
+    upstream = make_upstream(HangingClient())
+    open_breaker(upstream)
+
+    async def cancel_trial():
+        task = asyncio.create_task(upstream.request("POST", "/query"))
+        await asyncio.sleep(0)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(cancel_trial())
+
+    # The next call may be the trial again instead of being rejected for good
+    assert upstream.breaker.before_call() is True
+
+def test_trial_failure_reopens_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=60)
+    breaker.record_failure()
+    # Let the reset time pass so that the next call is the half-open trial
+    breaker._opened_at -= 60
+    first_opened_at = breaker._opened_at
+    assert breaker.state() == "half_open"
+    assert breaker.before_call() is True
+
+    breaker.record_failure()
+
+    assert breaker.state() == "open"
+    assert breaker._opened_at > first_opened_at
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+def test_backpressure_is_retried_and_not_counted_as_failure():
+    client = ScriptedClient([Response(503, {"Retry-After": "0"}), Response(200)])
+    upstream = make_upstream(client, retries=1)
+
+    response = asyncio.run(upstream.request("POST", "/query", idempotent=True))
+
+    assert response.status_code == 200
+    assert client.calls == 2
+    assert upstream.breaker.state() == "closed"
+    assert upstream.stats()["failures"] == 0
+    assert upstream.stats()["backpressure"] == 1
+
+def test_backpressure_never_opens_breaker():
+    client = ScriptedClient([Response(503, {"Retry-After": "0"})] * 3)
+    upstream = make_upstream(client)
+
+    for _ in range(3):
+        assert asyncio.run(upstream.request("POST", "/query")).status_code == 503
+
+    assert upstream.breaker.state() == "closed"
+
+def test_server_error_opens_breaker():
+    upstream = make_upstream(ScriptedClient([Response(500)]), reset_seconds=60)
+
+    asyncio.run(upstream.request("POST", "/query"))
+
+    assert upstream.breaker.state() == "open"
+
+def test_refused_connection_is_retried_for_sync_post():
+    refused = requests.ConnectionError(MaxRetryError(None, "/generate", reason=NewConnectionError(None, "refused")))
+    upstream = make_upstream(None, retries=1)
+    upstream._session = FailingSession(refused, Response(202))
+
+    assert upstream.request_sync("POST", "/generate").status_code == 202
+    assert upstream._session.calls == 2
+
+def test_broken_response_is_not_retried_for_sync_post():
+    broken = requests.ConnectionError(ProtocolError("Connection aborted."))
+    upstream = make_upstream(None, retries=1)
+    upstream._session = FailingSession(broken, Response(202))
+
+    with pytest.raises(requests.ConnectionError):
+        upstream.request_sync("POST", "/generate")
+    assert upstream._session.calls == 1
@@ -0,0 +1,258 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from config import Config
+
+# Shared clients of the upstream servers (embeddings server and LLM server replicas, see llm.py).
+# Each upstream keeps one pool of keep-alive connections for the async chat routes and one for the Flask threads,
+# has its own connect / read timeouts, retries idempotent calls a bounded number of times and sits behind a
+# circuit breaker, so that calls to a server that is down fail fast instead of waiting for their timeout.
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"The {name} server is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+# Circuit breaker: opens after failure_threshold consecutive failures and rejects calls for reset_seconds,
+# then lets one trial call through (half open) that closes it again on success. A trial that ends without an
+# outcome (cancelled, or failed with an error that says nothing about the server) is released for the next call.
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    # Check that a call may go through, raising CircuitOpen otherwise. Returns True when the call is the trial call,
+    # which must then end with record_success, record_failure or release_trial.
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            waited = time.monotonic() - self._opened_at
+            if waited < self.reset_seconds or self._trial_running:
+                raise CircuitOpen(self.name, max(1.0, self.reset_seconds - waited))
+            self._trial_running = True
+            return True
+
+    # Let another call be the trial call (the trial call ended without an outcome; harmless once it has one)
+    def release_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+# Helper function to tell whether a response counts as a failure of the upstream server
+def is_server_error(status_code: int):
+    return status_code >= 500
+
+# Helper function to get the Retry-After seconds of a 503 the server sends when it sheds load, or None.
+# Such a response shows the server is up, so it never counts as a failure of the breaker.
+def backpressure_delay(response):
+    if response.status_code != 503:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+# Helper function to tell whether a requests error happened while opening the connection (the request never reached
+# the server), like httpx.ConnectError. requests also raises ConnectionError when an open connection breaks while
+# the response is read; that call may have been served, so it does not count.
+def is_sync_connect_error(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    return isinstance(getattr(error.args[0], "reason", None), (NewConnectionError, ConnectTimeoutError))
+
+class Upstream:
+    def __init__(self, name: str, base_url: str, connect_timeout: float, read_timeout: float, retries: int,
+                 retry_backoff: float, max_connections: int, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.base_url = base_url
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_seconds)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._sync_timeout = (connect_timeout, read_timeout)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self._client = None
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+        self._counters = {"calls": 0, "retried": 0, "failures": 0, "rejected": 0, "backpressure": 0}
+        self._counters_lock = threading.Lock()
+
+    # Helper function to get the async client, opening its pool on first use
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self._timeout, limits=self._limits)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # Helper function to add to a counter
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    # Helper function to check the breaker before a call, counting rejected calls (True for the trial call)
+    def _before_call(self):
+        self._count("calls")
+        try:
+            return self.breaker.before_call()
+        except CircuitOpen:
+            self._count("rejected")
+            raise
+
+    # Helper function to tell whether a failed attempt may be retried.
+    # A connection that could not be opened never reached the server, so it is safe to retry for every call.
+    def _can_retry(self, attempt, idempotent, connect_failed):
+        return attempt < self.retries and (idempotent or connect_failed)
+
+    # Send a request, retrying idempotent calls (idempotent=None uses the HTTP method)
+    async def request(self, method: str, path: str, idempotent: bool = None, **kwargs):
+        idempotent = method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        attempt = 0
+        while True:
+            trial = self._before_call()
+            delay = self.retry_backoff * 2 ** attempt
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as e:
+                self._record_failure()
+                if not self._can_retry(attempt, idempotent, isinstance(e, httpx.ConnectError)):
+                    raise
+            else:
+                retry_after = self._record_response(response)
+                if retry_after is None and not is_server_error(response.status_code):
+                    return response
+                if not self._can_retry(attempt, idempotent, False):
+                    return response
+                if retry_after is not None:
+                    delay = retry_after
+            finally:
+                if trial:
+                    self.breaker.release_trial()
+            attempt += 1
+            self._count("retried")
+            await asyncio.sleep(delay)
+
+    # Stream a response (never retried: part of it may already have been relayed)
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs):
+        trial = self._before_call()
+        try:
+            async with self.client.stream(method, path, **kwargs) as response:
+                self._record_response(response)
+                yield response
+        except httpx.TransportError:
+            self._record_failure()
+            raise
+        finally:
+            if trial:
+                self.breaker.release_trial()
+
+    # Send a request from a thread (Flask routes), with the same retries and breaker as request()
+    def request_sync(self, method: str, path: str, idempotent: bool = None, **kwargs):
+        idempotent = method.upper() in IDEMPOTENT_METHODS if idempotent is None else idempotent
+        kwargs.setdefault("timeout", self._sync_timeout)
+        attempt = 0
+        while True:
+            trial = self._before_call()
+            delay = self.retry_backoff * 2 ** attempt
+            try:
+                response = self._session.request(method, f"{self.base_url}{path}", **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record_failure()
+                if not self._can_retry(attempt, idempotent, is_sync_connect_error(e)):
+                    raise
+            else:
+                retry_after = self._record_response(response)
+                if retry_after is None and not is_server_error(response.status_code):
+                    return response
+                if not self._can_retry(attempt, idempotent, False):
+                    return response
+                if retry_after is not None:
+                    delay = retry_after
+            finally:
+                if trial:
+                    self.breaker.release_trial()
+            attempt += 1
+            self._count("retried")
+            time.sleep(delay)
+
+    def _record_failure(self):
+        self._count("failures")
+        self.breaker.record_failure()
+
+    # Helper function to record the outcome of a response on the breaker, returning the Retry-After seconds when
+    # the server shed load (the call may be retried after that delay) and None otherwise
+    def _record_response(self, response):
+        retry_after = backpressure_delay(response)
+        if retry_after is not None:
+            self._count("backpressure")
+            self.breaker.record_success()
+        elif is_server_error(response.status_code):
+            self._record_failure()
+        else:
+            self.breaker.record_success()
+        return retry_after
+
+    def stats(self):
+        with self._counters_lock:
+            return {"state": self.breaker.state(), **self._counters}
+
+# Every upstream created, for stats and shutdown
+UPSTREAMS = []
+
+# Helper function to create an upstream with the shared retry and breaker settings
+def create_upstream(name, base_url, read_timeout):
+    upstream = Upstream(name, base_url, connect_timeout=Config.UPSTREAM_CONNECT_TIMEOUT_SECONDS, read_timeout=read_timeout,
+                    retries=Config.UPSTREAM_RETRIES, retry_backoff=Config.UPSTREAM_RETRY_BACKOFF_SECONDS,
+                    max_connections=Config.UPSTREAM_MAX_CONNECTIONS, failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+                    reset_seconds=Config.CIRCUIT_RESET_SECONDS)
+    UPSTREAMS.append(upstream)
+    return upstream
+
+embeddings = create_upstream("embeddings", f"http://embeddings-server:{Config.EMBEDDINGS_SERVER_PORT}", Config.EMBEDDINGS_TIMEOUT_SECONDS)
+
+# Close the async connection pools (on shutdown of the ASGI app)
+async def close_all():
+    for upstream in UPSTREAMS:
+        await upstream.aclose()
+
+# Get the state and counters of every upstream
+def stats():
+    return {upstream.name: upstream.stats() for upstream in UPSTREAMS}
@@ -20,6 +20,14 @@ const AgentInfo = ({ agentData, isEditMode, onSave, toggleEditMode, error, onRet
     }));
   };
 
+  const handleCheckboxChange = (e) => {
+    const { name, checked } = e.target;
+    setLocalData((prevData) => ({
+      ...prevData,
+      [name]: checked,
+    }));
+  };
+
   const handlePromptChange = (index, value) => {
     setLocalData((prevData) => {
       // Create a shallow copy of the existing prompts
@@ -113,6 +121,18 @@ const AgentInfo = ({ agentData, isEditMode, onSave, toggleEditMode, error, onRet
         </div>
       </div>
 
+      <label className="flex items-center mt-8 space-x-2 text-sm text-gray-700">
+        <input
+          type="checkbox"
+          id="answer_cache"
+          name="answer_cache"
+          checked={!!localData.answer_cache}
+          onChange={handleCheckboxChange}
+          disabled={!isEditMode}
+        />
+        <span>Reuse answers to near-identical first questions</span>
+      </label>
+
       <div className="flex justify-between items-center mt-8">
         <div className="flex items-center">
           {error && <ErrorBlock>{error}</ErrorBlock>}
@@ -24,7 +24,8 @@ const Agent = () => {
     suggested_prompts: ['','',''],
     files: [],
     status: '',
-    embeddings_status: ''
+    embeddings_status: '',
+    answer_cache: false
   });
   const [isEditMode, setIsEditMode] = useState(!agentname);
   const [activeTab, setActiveTab] = useState('Info');
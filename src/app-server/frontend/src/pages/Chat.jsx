@@ -15,6 +15,8 @@ const Chat = () => {
   const [containerHeight, setContainerHeight] = useState(0)
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState(null);
+  // notice shown below the conversation, never part of the messages sent to the server
+  const [notice, setNotice] = useState(null);
 
   const [agentData, setAgentData] = useState({
     name: '',
@@ -27,31 +29,61 @@ const Chat = () => {
     { content: agentData.welcome_message, role: 'system' },
   ]);
   const [input, setInput] = useState('');
+  // the server keeps the conversation of a session, so only the new input is sent once a session is started
+  const [sessionId, setSessionId] = useState(null);
 
   const handleSendMessage = async () => {
     console.log('message is:', input)
     if (input.trim()) {
       const datatoadd = []
-      // send the input and messages history
-      let data = {
-        "input": input,
-        "messages": messages
-      }
+      // send the input with the session id, or with the messages history to start a session
+      const data = sessionId ? { "input": input, "session_id": sessionId } : { "input": input, "messages": messages }
       // add user request
       datatoadd.push({ content: input, role: 'user' })
       setMessages([...messages, ...datatoadd]);
       // reset input
       setInput('');
+      setNotice(null)
       setLoading(true)
       try {
-        // submit to server
-        const url = `/api/chat/${agentData.name}`
-        const headers = { headers: { 'Content-Type': 'application/json', 'Accept': 'text/plain;charset=utf-8' } }
-        // await response from api call
-        const response = await axios.post(url, data, headers)
-        // add response to message
-        datatoadd.push({ content: response.data.content, role: response.data.role })
-        setMessages([...messages, ...datatoadd]);
+        // submit to server and read the answer as a stream of server-sent events
+        const url = `/api/chat/${agentData.name}/stream`
+        const post = (body) => fetch(url, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+          body: JSON.stringify(body),
+        })
+        let response = await post(data)
+        if (response.status === 409) {
+          // the session has expired: start a new one with the messages history
+          response = await post({ "input": input, "messages": messages })
+        }
+        if (response.status === 503) {
+          // too many requests are waiting for the LLM: take the turn back so that it can be sent again
+          setMessages(messages);
+          setInput(input);
+          setNotice('The agent is busy, please try again in a moment.')
+          setLoading(false)
+          return
+        }
+        if (!response.ok || !response.body) {
+          throw new Error(`Chat request failed with status ${response.status}`)
+        }
+        // add the response to the messages as its tokens arrive
+        const answer = { content: '', role: 'assistant' }
+        datatoadd.push(answer)
+        await readEventStream(response.body, (event, payload) => {
+          if (event === 'message') {
+            answer.content += payload.content
+            setMessages([...messages, ...datatoadd.slice(0, -1), { ...answer }]);
+          } else if (event === 'error') {
+            answer.content = payload.content
+            setMessages([...messages, ...datatoadd.slice(0, -1), { ...answer }]);
+          }
+          if (payload.session_id) {
+            setSessionId(payload.session_id)
+          }
+        })
         // stop loading
         setLoading(false)
       } catch (err) {
@@ -61,6 +93,32 @@ const Chat = () => {
     }
   }
 
+  // read server-sent events from a fetch response body, calling onEvent(event, payload) for each of them
+  const readEventStream = async (body, onEvent) => {
+    const reader = body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+      // events are separated by a blank line
+      let separator = buffer.indexOf('\n\n')
+      while (separator !== -1) {
+        const block = buffer.slice(0, separator)
+        buffer = buffer.slice(separator + 2)
+        let event = 'message'
+        let data = ''
+        for (const line of block.split('\n')) {
+          if (line.startsWith('event:')) event = line.slice(6).trim()
+          else if (line.startsWith('data:')) data += line.slice(5).trim()
+        }
+        if (data) onEvent(event, JSON.parse(data))
+        separator = buffer.indexOf('\n\n')
+      }
+    }
+  }
+
   const handleSuggestedPrompt = (index) => {
     if (index >= 0 && index < agentData.suggested_prompts.length) {
       setInput(agentData.suggested_prompts[index])
@@ -161,6 +219,7 @@ const Chat = () => {
         </div>
       }
       {error && <ErrorBlock>{error}</ErrorBlock>}
+      {notice && <div className="px-2 font-thin text-xs md:text-sm lg:text-md text-gray-800">{notice}</div>}
       {loading && <div className="px-2 font-thin text-xs md:text-sm lg:text-md text-gray-800">Agent is working on your request ...</div>}
     </div>
   );
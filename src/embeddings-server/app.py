@@ -1,12 +1,23 @@
 import os
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from llama_index.core.text_splitter import TokenTextSplitter
-from llama_index.core.readers.file.base import SimpleDirectoryReader
-from sentence_transformers import SentenceTransformer
 import chromadb
-import httpx
 import asyncio
+import threading
+import time
+from config import settings
+from manifest import load_manifest, save_manifest, delete_manifest, diff_agent_files, chunk_ids, list_manifest_agents
+from backends import load_configured_model
+from embedding_cache import EmbeddingCache, encode_with_cache
+from ttl_cache import TTLCache
+from batching import QueryBatcher
+from executor import BoundedExecutor, Overloaded
+from pipeline import start_stage, iter_chunk_batches
+from registry import CollectionRegistry
+from context import select_chunks
+from jobs import Job, create_job, register_job, get_job, list_jobs, run_job, agent_lock, FINISHED_STATUSES
 
 # Constants from environment variables
 AGENT_DIR = os.path.join(os.getenv("DATA_DIR"), "agents")
@@ -18,40 +29,261 @@ HF_API_TOKEN = os.getenv("HF_API_TOKEN")
 # Initialize FastAPI app
 app = FastAPI()
 
-# Initialize the Hugging Face embedding model
-embedding_model = SentenceTransformer(model_name_or_path=EMBEDDING_MODEL_NAME, cache_folder=MODEL_DIR, token=HF_API_TOKEN)
+# Initialize the Hugging Face embedding model with the configured backend (torch, onnx or onnx-int8)
+embedding_model, embedding_backend = load_configured_model(EMBEDDING_MODEL_NAME)
+# Vectors of different backends are close but not identical, so cached vectors are kept apart per backend
+EMBEDDING_MODEL_KEY = f"{EMBEDDING_MODEL_NAME}@{embedding_backend}"
+
+# Initialize the on-disk cache of chunk embeddings (disabled when its size is set to 0)
+embedding_cache = None
+if settings.EMBEDDING_CACHE_MAX_ENTRIES > 0:
+    embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_KEY,
+                                     embedding_model.get_sentence_embedding_dimension(), settings.EMBEDDING_CACHE_MAX_ENTRIES)
 
 # Initialize the ChromaDB client
 client = chromadb.PersistentClient(path=CHROMA_DB_DIR)
 
+# Initialize the registry of open collection handles
+collection_registry = CollectionRegistry(client)
+
+# Initialize the in-process caches used by /query: prompt embeddings keyed by (model, normalized prompt)
+# and retrieval results keyed by (agent, normalized prompt, top_k, index version, selection options)
+prompt_embedding_cache = TTLCache(settings.PROMPT_EMBEDDING_CACHE_SIZE, settings.QUERY_CACHE_TTL_SECONDS)
+retrieval_cache = TTLCache(settings.RETRIEVAL_CACHE_SIZE, settings.QUERY_CACHE_TTL_SECONDS)
+
+# Initialize the bounded executor running model inference and chromadb calls for the API, so handlers never block
+# the event loop and overload is answered with 503 instead of an ever growing latency
+inference_executor = BoundedExecutor(settings.INFERENCE_WORKERS, settings.INFERENCE_QUEUE_SIZE, "inference")
+
+# Initialize the executor running ingestion jobs, kept apart so jobs never take the slots of queries, with a bounded
+# queue so that /generate answers 503 instead of piling up jobs
+job_executor = BoundedExecutor(settings.JOB_WORKERS, settings.JOB_QUEUE_SIZE, "job")
+
+# Helper function to encode a list of texts in one model call (blocking)
+def encode_texts(texts: list, batch_size: int = None):
+    return embedding_model.encode(texts, batch_size=batch_size or len(texts), convert_to_numpy=True)
+
+# Initialize the coalescer batching the prompt encodes of concurrent queries
+query_batcher = QueryBatcher(
+    encode_texts, inference_executor, settings.QUERY_BATCH_MAX_SIZE, settings.QUERY_BATCH_MAX_WAIT_MS,
+    settings.QUERY_BATCH_MAX_SIZE * settings.INFERENCE_QUEUE_SIZE)
+
+# Version of each agent's index, changed by every /generate run (also stored in the manifest to survive restarts)
+index_versions = {}
+
 # Request Models
 class GenerateRequest(BaseModel):
     agent_name: str
+    full_rebuild: bool = False  # Re-embed every file instead of only the added or changed ones
 
 class QueryRequest(BaseModel):
     agent_name: str
     prompt: str
     top_k: int = 5  # Default to 5 if not provided
+    min_similarity: Optional[float] = None  # Drop chunks whose cosine similarity to the prompt is lower
+    dedup_threshold: Optional[float] = None  # Drop chunks at least this similar to a chunk already selected
+    mmr_lambda: float = 1.0  # Relevance / diversity trade-off of the selection, 1.0 keeps the order of relevance
+    token_budget: Optional[int] = None  # Maximum number of tokens of all returned chunks
+    candidates: Optional[int] = None  # Chunks retrieved before selection (defaults to a multiple of top_k when selecting)
 
-# Helper function to notify app server
-async def notify_app_server(agent_name: str):
-    url = f"http://app-server:8080/api/agents/{agent_name}/update-embeddings-status"
-    
+class BatchQueryRequest(BaseModel):
+    items: List[QueryRequest]
+
+class EmbedRequest(BaseModel):
+    agent_name: str
+    prompt: str
+
+# Helper function to normalize a prompt so that trivially different spellings share cache entries
+def normalize_prompt(prompt: str):
+    return " ".join(prompt.split())
+
+# Helper function to get the current index version of an agent (its manifest is read on the bounded executor the
+# first time)
+async def get_index_version(agent_name: str):
+    if agent_name not in index_versions:
+        version = (await inference_executor.run(load_manifest, agent_name)).get("version", 0)
+        index_versions.setdefault(agent_name, version)
+    return index_versions[agent_name]
+
+# Helper function to give an agent's index a new version and drop its cached retrieval results
+def bump_index_version(agent_name: str, manifest: dict):
+    manifest["version"] = time.time_ns()
+    index_versions[agent_name] = manifest["version"]
+    retrieval_cache.invalidate(lambda key: key[0] == agent_name)
+
+# Helper function to refuse the queries of an agent whose index was built with another embedding model or backend:
+# its vectors cannot be compared with prompts encoded now (503 until the rebuild started at startup lands)
+def reject_stale_index(agent_name: str):
+    if agent_name in stale_indexes:
+        raise HTTPException(status_code=503, detail=f"The index of agent {agent_name} is being rebuilt for embedding model {EMBEDDING_MODEL_KEY}",
+                            headers={"Retry-After": str(settings.RETRY_AFTER_SECONDS)})
+
+# Helper function to get the collection of an agent, opening it on the bounded executor when it is not open yet
+# (an agent that was never indexed is rejected without using the executor)
+async def find_collection(agent_name: str):
+    collection = collection_registry.cached(agent_name)
+    if collection is None and collection_registry.known(agent_name):
+        collection = await inference_executor.run(collection_registry.get, agent_name)
+    return collection
+
+# Answer calls rejected by a full executor queue with 503 and a hint on when to retry
+@app.exception_handler(Overloaded)
+async def overloaded_exception_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Embeddings server is overloaded, retry later"},
+        headers={"Retry-After": str(settings.RETRY_AFTER_SECONDS)})
+
+# Helper function to get the number of chunks to retrieve before selecting the top_k of a query
+def candidate_count(query: QueryRequest):
+    if query.candidates:
+        return max(query.candidates, query.top_k)
+    if query.min_similarity is None and query.dedup_threshold is None and query.mmr_lambda >= 1.0 and query.token_budget is None:
+        return query.top_k
+    return query.top_k * settings.RETRIEVAL_CANDIDATES_FACTOR
+
+# Helper function to build the retrieval cache key of a query
+def retrieval_key(query: QueryRequest, index_version: int):
+    return (query.agent_name, normalize_prompt(query.prompt), query.top_k, index_version,
+            query.min_similarity, query.dedup_threshold, query.mmr_lambda, query.token_budget, candidate_count(query))
+
+# Helper function to get the embedding of a normalized prompt, encoding it only if it is not cached
+async def embed_prompt(normalized_prompt: str):
+    prompt_key = (EMBEDDING_MODEL_KEY, normalized_prompt)
+    prompt_embedding = prompt_embedding_cache.get(prompt_key)
+    if prompt_embedding is None:
+        prompt_embedding = await query_batcher.encode(normalized_prompt)
+        prompt_embedding_cache.put(prompt_key, prompt_embedding)
+    return prompt_embedding
+
+# Helper function to retrieve the chunks of several queries from one collection and select the ones to return (blocking)
+def retrieve_chunks(collection, queries: list, prompt_embeddings: list):
+    results = collection.query(
+        query_embeddings=[prompt_embedding.tolist() for prompt_embedding in prompt_embeddings],
+        n_results=max(candidate_count(query) for query in queries), # Retrieve enough candidates for every query
+        include=["documents", "embeddings"]
+    )
+    retrieved = []
+    for query, prompt_embedding, documents, embeddings in zip(queries, prompt_embeddings, results['documents'], results['embeddings']):
+        # Results come back closest first, so each query keeps its own number of candidates
+        count = candidate_count(query)
+        chunks, stats = select_chunks(prompt_embedding, documents[:count], embeddings[:count], query.top_k,
+                                      query.min_similarity, query.dedup_threshold, query.mmr_lambda, query.token_budget)
+        retrieved.append({"results": [chunks], **stats})
+    return retrieved
+
+# Index the added / changed files of an agent and drop the vectors of removed ones (runs in a worker thread)
+def index_agent(job: Job):
+    agent_name = job.agent_name
+    agent_dir = os.path.join(AGENT_DIR, agent_name)
+
+    # Step 1: Compare the agent's files against the manifest of the last run
+    manifest = {"files": {}} if job.full_rebuild else load_manifest(agent_name)
+    if manifest.get("model") != EMBEDDING_MODEL_KEY:
+        # The vectors were made by another model or backend and cannot be compared with the new ones
+        manifest = {"files": {}}
+    if not manifest["files"]:
+        # Nothing (or an index with positional ids) recorded for this agent, so start from a clean collection
+        collection_registry.delete(agent_name)
+        delete_manifest(agent_name)
+    manifest["model"] = EMBEDDING_MODEL_KEY
+    changed_files, removed_files, file_hashes = diff_agent_files(agent_dir, manifest)
+    job.files_total = len(changed_files)
+
+    # Open (or create) the collection and register its handle for queries
+    collection = collection_registry.open(agent_name)
+
+    # Step 2: Remove the vectors of deleted and changed files using their file-scoped ids
+    stale_ids = []
+    for filename in removed_files + changed_files:
+        if filename in manifest["files"]:
+            stale_ids.extend(chunk_ids(filename, manifest["files"].pop(filename)["chunks"]))
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+    bump_index_version(agent_name, manifest)
+    save_manifest(agent_name, manifest)
+
+    # Step 3: Stream the added or changed files through the pipeline: read file -> split -> encode batch -> write batch.
+    # Stages are connected by bounded queues, so peak memory depends on the batch size and not on the corpus size.
+    # Write the chunks in bulk, never exceeding the maximum batch size accepted by chromadb
+    write_batch_size = min(settings.STORE_WRITE_BATCH_SIZE, client.get_max_batch_size())
+    chunk_counts = {}
+    stop_event = threading.Event()
     try:
-        async with httpx.AsyncClient() as client:
-            # Making the async POST request without body
-            response = await client.post(url)
-            
-            # Optionally, check the response
-            if response.status_code == 200:
-                print(f"Successfully notified app-server for agent {agent_name}")
-            else:
-                print(f"Failed to notify app-server: {response.status_code}")
-    except Exception as e:
-        print(e)
+        chunk_batches = start_stage(
+            iter_chunk_batches(agent_dir, changed_files, write_batch_size, job, chunk_counts),
+            settings.PIPELINE_QUEUE_SIZE, stop_event)
+        embedded_batches = start_stage(
+            ((batch, encode_with_cache(embedding_cache, embedding_model, [text for _, _, text in batch], settings.EMBEDDING_BATCH_SIZE))
+             for batch in chunk_batches),
+            settings.PIPELINE_QUEUE_SIZE, stop_event)
+
+        job.embedding_started_at = time.time()
+        start_time = time.perf_counter()
+        for batch, embeddings in embedded_batches:
+            job.check_cancelled()
+            # Step 4: Store each batch of embeddings in ChromaDB as soon as it is ready
+            collection.upsert(
+                documents=[text for _, _, text in batch],              # Chunked document text
+                embeddings=embeddings.tolist(),                        # Embedding vectors
+                metadatas=[{"file": filename} for _, filename, _ in batch], # Source file of each chunk
+                ids=[document_id for document_id, _, _ in batch]       # File-scoped ID for each chunk
+            )
+            job.chunks_embedded += len(batch)
+        elapsed = time.perf_counter() - start_time
+    except Exception:
+        # Drop any partially written vectors; the files are not in the manifest, so the next run re-embeds them
+        if changed_files:
+            collection.delete(where={"file": {"$in": changed_files}})
+        bump_index_version(agent_name, manifest)
+        save_manifest(agent_name, manifest)
+        raise
+    finally:
+        # Stop the reader and encoder stages if the writer ended early
+        stop_event.set()
+
+    # Step 5: Record the indexed files so the next run only picks up what changed
+    for filename in changed_files:
+        manifest["files"][filename] = {"hash": file_hashes[filename], "chunks": chunk_counts[filename]}
+    bump_index_version(agent_name, manifest)
+    save_manifest(agent_name, manifest)
+    stale_indexes.pop(agent_name, None)
 
-# Step 1: /generate endpoint to process and store embeddings
-@app.post("/generate")
+    return {
+        "files_embedded": len(changed_files),
+        "files_removed": len(removed_files),
+        "files_unchanged": len(file_hashes) - len(changed_files),
+        "files": {filename: manifest["files"][filename] for filename in changed_files}, # Hash and chunk count of each embedded file
+        "chunks": job.chunks_embedded,
+        "elapsed_seconds": round(elapsed, 3),
+        "chunks_per_second": round(job.chunks_embedded / elapsed, 2) if elapsed > 0 else None
+    }
+
+# Helper function to rebuild, one agent at a time, the indexes built with another embedding model or backend
+# (runs in a thread started at startup; jobs are registered, so their progress shows in /jobs)
+def rebuild_stale_indexes():
+    for agent_name in list(stale_indexes):
+        job = create_job(agent_name)
+        print(f"Rebuilding the index of agent {agent_name} (built with {stale_indexes.get(agent_name)}) as job {job.id}")
+        run_job(job, index_agent)  # index_agent starts from a clean collection when the model differs
+
+# Helper function to find the indexes built with another embedding model or backend (agent_name -> their model key)
+def find_stale_indexes():
+    stale = {}
+    for agent_name in list_manifest_agents():
+        model = load_manifest(agent_name).get("model")
+        if model != EMBEDDING_MODEL_KEY:
+            stale[agent_name] = model
+    return stale
+
+# Agents whose index was built with another embedding model or backend: their queries are refused until their
+# index is rebuilt, which starts right away
+stale_indexes = find_stale_indexes()
+if stale_indexes:
+    threading.Thread(target=rebuild_stale_indexes, daemon=True).start()
+
+# Step 1: /generate endpoint to start a job that processes and stores embeddings
+@app.post("/generate", status_code=202)
 async def generate_embeddings(request: GenerateRequest):
     agent_name = request.agent_name
     agent_dir = os.path.join(AGENT_DIR, agent_name)
@@ -59,74 +291,107 @@ async def generate_embeddings(request: GenerateRequest):
     if not os.path.exists(agent_dir):
         raise HTTPException(status_code=404, detail=f"Directory for agent {agent_name} not found")
 
-    try:
-        # Step 1: Load the documents from the agent's directory
-        directory_reader = SimpleDirectoryReader(agent_dir)
-        documents = directory_reader.load_data()
-
-        # Step 2: Chunk documents with overlap (ignoring sentence/chapter boundaries)
-        text_splitter = TokenTextSplitter(chunk_size=512, chunk_overlap=50)
-        chunked_documents = []
-        for doc in documents:
-            chunks = text_splitter.split_text(doc.text)
-            chunked_documents.extend(chunks)
-
-        # Step 3: Generate embeddings for each chunk using the Hugging Face model
-        embeddings = []
-        for chunk in chunked_documents:
-            vector = embedding_model.encode(chunk)
-            embeddings.append(vector)
-
-        # Step 4: Store the embeddings in ChromaDB
-        collection_name = f"agent_{agent_name}"
-        # Use get_or_create_collection to manage the collection
-        collection = client.get_or_create_collection(name=collection_name)
-        # Add each chunk with its embedding into ChromaDB
-        for i, chunk in enumerate(chunked_documents):
-            document_id = f"doc_chunk_{i}"
-            collection.add(
-                documents=[chunk],       # Chunked document text
-                embeddings=[embeddings[i].tolist()],  # Embedding vector
-                ids=[document_id]        # Unique ID for each chunk
-            )
+    # Run the job off the event loop so that queries are served while it is in progress (503 when too many jobs wait)
+    job = Job(agent_name, request.full_rebuild)
+    job_executor.submit(run_job, job, index_agent)
+    register_job(job)
 
-        # call app server as an async function
-        asyncio.create_task(notify_app_server(agent_name))
+    return {"status": "accepted", "job_id": job.id, "agent_name": agent_name}
 
-        return {"status": "success", "message": f"Embeddings generated and stored for agent {agent_name}"}
+# /jobs endpoint to list the jobs, optionally of a single agent
+@app.get("/jobs")
+async def get_jobs(agent_name: Optional[str] = None):
+    return {"status": "success", "jobs": [job.to_dict() for job in list_jobs(agent_name)]}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing agent {agent_name}: {str(e)}")
+# /jobs/{job_id} endpoint to read the progress or completion record of a job
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return {"status": "success", "job": job.to_dict()}
+
+# /jobs/{job_id}/cancel endpoint to stop a queued or running job
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status in FINISHED_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has already finished with status {job.status}")
+    job.cancel()
+    return {"status": "success", "job": job.to_dict()}
+
+
+# Helper function to remove everything stored for an agent (blocking, waits for a running job to stop)
+def delete_agent_index(agent_name: str):
+    with agent_lock(agent_name):
+        collection_registry.delete(agent_name)
+        delete_manifest(agent_name)
+        index_versions.pop(agent_name, None)
+        stale_indexes.pop(agent_name, None)
+        retrieval_cache.invalidate(lambda key: key[0] == agent_name)
 
+# /agents/{agent_name} endpoint to delete the embeddings of an agent
+@app.delete("/agents/{agent_name}")
+async def delete_agent_embeddings(agent_name: str):
+    # Stop the agent's queued or running jobs first
+    for job in list_jobs(agent_name):
+        if job.status not in FINISHED_STATUSES:
+            job.cancel()
+    await job_executor.run(delete_agent_index, agent_name)
+    return {"status": "success", "message": f"Embeddings deleted for agent {agent_name}"}
+
+# /stats endpoint to report the counters of the server's caches
+@app.get("/stats")
+async def get_stats():
+    return {
+        "status": "success",
+        "embedding_backend": embedding_backend,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "prompt_embedding_cache": prompt_embedding_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "query_batcher": query_batcher.stats(),
+        "inference_executor": inference_executor.stats(),
+        "job_executor": job_executor.stats(),
+        "collection_registry": collection_registry.stats()
+    }
 
 # Step 2: /query endpoint to retrieve document chunks based on a prompt
 @app.post("/query")
 async def query_embeddings(request: QueryRequest):
     agent_name = request.agent_name
     prompt = request.prompt
-    top_k = request.top_k
+
+    # Reject agents without embeddings before doing any work (this never creates a collection)
+    collection = await find_collection(agent_name)
+    if collection is None:
+        raise HTTPException(status_code=404, detail=f"No embeddings found for agent {agent_name}")
+    reject_stale_index(agent_name)
 
     try:
-        # Step 1: Generate the embedding for the query prompt
-        prompt_embedding = embedding_model.encode(prompt)
+        normalized_prompt = normalize_prompt(prompt)
+        index_version = await get_index_version(agent_name)
 
-        # Step 2: Access the ChromaDB collection for the specified agent
-        collection_name = f"agent_{agent_name}"
-        collection = client.get_or_create_collection(name=collection_name)
+        # Step 1: Return the cached results if this agent's index answered the same prompt before
+        key = retrieval_key(request, index_version)
+        retrieved = retrieval_cache.get(key)
+        if retrieved is None:
+            # Step 2: Generate (or reuse) the embedding for the query prompt
+            prompt_embedding = await embed_prompt(normalized_prompt)
 
-        # Step 3: Query ChromaDB for the most relevant document chunks
-        results = collection.query(
-            query_embeddings=[prompt_embedding.tolist()],
-            n_results=top_k  # Use the top_k parameter to retrieve the top 'k' results
-        )
+            # Step 3: Query the agent's ChromaDB collection for the most relevant document chunks and select
+            # the ones to return (similarity cutoff, overlap and duplicate removal, MMR under the token budget)
+            retrieved = (await inference_executor.run(retrieve_chunks, collection, [request], [prompt_embedding]))[0]
+            retrieval_cache.put(key, retrieved)
 
-        # Extract and return the relevant document chunks
-        document_chunks = results['documents']
+        # Return the relevant document chunks with the prompt tokens they take and save
         return {
             "status": "success",
             "agent_name": agent_name,
             "prompt": prompt,
-            "results": document_chunks
+            "index_version": index_version,
+            **retrieved
         }
     
         # In the function calling the query apply the following
@@ -135,10 +400,120 @@ async def query_embeddings(request: QueryRequest):
 
 
 
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query for agent {agent_name}: {str(e)}")
 
 
+# /embed endpoint to get the embedding of a prompt with the agent's index version, without retrieval
+# (used by the app server to look up answers to similar prompts)
+@app.post("/embed")
+async def embed(request: EmbedRequest):
+    prompt_embedding = await embed_prompt(normalize_prompt(request.prompt))
+    return {
+        "status": "success",
+        "agent_name": request.agent_name,
+        "model": EMBEDDING_MODEL_KEY,
+        "index_version": await get_index_version(request.agent_name),
+        "embedding": [float(value) for value in prompt_embedding]
+    }
+
+# /query/batch endpoint to retrieve document chunks for many (agent_name, prompt, top_k) items at once
+@app.post("/query/batch")
+async def query_embeddings_batch(request: BatchQueryRequest):
+    items = request.items
+    if len(items) > settings.QUERY_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.QUERY_BATCH_MAX_ITEMS} items can be sent in one batch")
+
+    results = [None] * len(items)
+    pending = {}  # agent_name -> indices of the items still to be retrieved
+    collections = {}
+    retrieval_keys = {}
+    for i, item in enumerate(items):
+        # Step 1: Reject agents without embeddings and answer items found in the retrieval cache
+        if item.agent_name not in collections:
+            collections[item.agent_name] = await find_collection(item.agent_name)
+        if collections[item.agent_name] is None:
+            results[i] = {"status": "error", "detail": f"No embeddings found for agent {item.agent_name}"}
+            continue
+        if item.agent_name in stale_indexes:
+            results[i] = {"status": "error", "detail": f"The index of agent {item.agent_name} is being rebuilt for embedding model {EMBEDDING_MODEL_KEY}"}
+            continue
+        retrieval_keys[i] = retrieval_key(item, await get_index_version(item.agent_name))
+        retrieved = retrieval_cache.get(retrieval_keys[i])
+        if retrieved is not None:
+            results[i] = {"status": "success", **retrieved}
+        else:
+            pending.setdefault(item.agent_name, []).append(i)
+
+    # Step 2: Encode every prompt that is not cached yet in one batched pass
+    prompt_embeddings = {}
+    missing_prompts = {}  # ordered set of the prompts to encode
+    for indices in pending.values():
+        for i in indices:
+            normalized_prompt = retrieval_keys[i][1]
+            if normalized_prompt in prompt_embeddings or normalized_prompt in missing_prompts:
+                continue
+            prompt_embedding = prompt_embedding_cache.get((EMBEDDING_MODEL_KEY, normalized_prompt))
+            if prompt_embedding is None:
+                missing_prompts[normalized_prompt] = None
+            else:
+                prompt_embeddings[normalized_prompt] = prompt_embedding
+    encode_errors = {}  # normalized prompt -> error of the prompts that could not be encoded
+    if missing_prompts:
+        missing_prompts = list(missing_prompts)
+        try:
+            vectors = await inference_executor.run(encode_texts, missing_prompts, settings.EMBEDDING_BATCH_SIZE)
+        except Overloaded:
+            raise
+        except Exception:
+            # Encode the prompts one at a time so that only the items of the failing prompts get an error
+            vectors = []
+            for normalized_prompt in missing_prompts:
+                try:
+                    vectors.append((await inference_executor.run(encode_texts, [normalized_prompt]))[0])
+                except Overloaded:
+                    raise
+                except Exception as e:
+                    encode_errors[normalized_prompt] = str(e)
+                    vectors.append(None)
+        for normalized_prompt, vector in zip(missing_prompts, vectors):
+            if vector is None:
+                continue
+            prompt_embeddings[normalized_prompt] = vector
+            prompt_embedding_cache.put((EMBEDDING_MODEL_KEY, normalized_prompt), vector)
+
+    # Step 3: Query each agent's collection once for all of its items and select each item's chunks
+    for agent_name, indices in pending.items():
+        for i in [i for i in indices if retrieval_keys[i][1] in encode_errors]:
+            results[i] = {"status": "error", "detail": f"Error encoding the prompt: {encode_errors[retrieval_keys[i][1]]}"}
+        indices = [i for i in indices if retrieval_keys[i][1] not in encode_errors]
+        if not indices:
+            continue
+        try:
+            retrieved = await inference_executor.run(
+                retrieve_chunks, collections[agent_name], [items[i] for i in indices],
+                [prompt_embeddings[retrieval_keys[i][1]] for i in indices])
+        except Overloaded:
+            raise
+        except Exception as e:
+            for i in indices:
+                results[i] = {"status": "error", "detail": f"Error processing query for agent {agent_name}: {str(e)}"}
+            continue
+        for i, item_retrieved in zip(indices, retrieved):
+            results[i] = {"status": "success", **item_retrieved}
+            retrieval_cache.put(retrieval_keys[i], item_retrieved)
+
+    # Return the results in the order of the items
+    return {
+        "status": "success",
+        "results": [
+            {"agent_name": item.agent_name, "prompt": item.prompt, "index_version": retrieval_keys[i][3] if i in retrieval_keys else None, **result}
+            for i, (item, result) in enumerate(zip(items, results))
+        ]
+    }
+
 # Step 3: Run the FastAPI app with Uvicorn
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,81 @@
+import os
+import re
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from config import settings
+
+# Embedding backends selectable with EMBEDDING_BACKEND:
+#   torch     - the PyTorch model (default)
+#   onnx      - the model exported to ONNX and run with ONNX Runtime
+#   onnx-int8 - the ONNX model with dynamic int8 quantization for the CPU set in ONNX_QUANTIZATION_CONFIG
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Sentences used to compare a backend against the PyTorch model
+PARITY_SENTENCES = [
+    "What are the opening hours of the office?",
+    "The quarterly report shows a steady increase in revenue across all regions.",
+    "Please summarize the main points of the attached document.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose.",
+    "How do I reset my password if I no longer have access to my email?",
+    "The contract may be terminated by either party with thirty days written notice.",
+]
+
+# Helper function to get the directory the quantized export of a model is kept in
+def quantized_model_dir(model_name: str):
+    return os.path.join(settings.MODELS_DIR, "onnx", re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+
+# Load the embedding model with the given backend
+def load_embedding_model(model_name: str, backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend}, expected one of {', '.join(BACKENDS)}")
+
+    if backend == "torch":
+        return SentenceTransformer(model_name_or_path=model_name, cache_folder=settings.MODELS_DIR, token=settings.HF_API_TOKEN)
+
+    if backend == "onnx":
+        return SentenceTransformer(model_name_or_path=model_name, cache_folder=settings.MODELS_DIR, token=settings.HF_API_TOKEN, backend="onnx")
+
+    # Export and quantize the model once, then load the int8 file from the local export
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    quantization_config = settings.ONNX_QUANTIZATION_CONFIG
+    file_name = f"onnx/model_qint8_{quantization_config}.onnx"
+    model_dir = quantized_model_dir(model_name)
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        onnx_model = SentenceTransformer(model_name_or_path=model_name, cache_folder=settings.MODELS_DIR, token=settings.HF_API_TOKEN, backend="onnx")
+        onnx_model.save_pretrained(model_dir)
+        export_dynamic_quantized_onnx_model(onnx_model, quantization_config, model_dir)
+    return SentenceTransformer(model_name_or_path=model_dir, backend="onnx", model_kwargs={"file_name": file_name})
+
+# Compare the vectors of a model against the PyTorch reference
+def check_parity(reference_model, candidate_model, sentences: list = PARITY_SENTENCES):
+    """
+    Encodes the sentences with both models and compares the vectors by cosine similarity.
+
+    :param reference_model: The PyTorch SentenceTransformer.
+    :param candidate_model: The model to check.
+    :param sentences: The sentences to encode.
+
+    :return: A dictionary with the minimum and mean cosine similarity over the sentences.
+    """
+    reference = reference_model.encode(sentences, convert_to_numpy=True, normalize_embeddings=True)
+    candidate = candidate_model.encode(sentences, convert_to_numpy=True, normalize_embeddings=True)
+    similarities = np.sum(reference * candidate, axis=1)
+    return {"min_similarity": float(np.min(similarities)), "mean_similarity": float(np.mean(similarities))}
+
+# Load the configured backend, falling back to PyTorch if its vectors drift too far from the PyTorch ones
+def load_configured_model(model_name: str):
+    """
+    :return: A tuple (model, backend) with the loaded model and the backend actually in use.
+    """
+    backend = settings.EMBEDDING_BACKEND
+    model = load_embedding_model(model_name, backend)
+    if backend == "torch" or not settings.EMBEDDING_PARITY_CHECK:
+        return model, backend
+
+    reference_model = load_embedding_model(model_name, "torch")
+    parity = check_parity(reference_model, model)
+    print(f"Embedding backend {backend} parity against torch: {parity}")
+    if parity["min_similarity"] < settings.EMBEDDING_PARITY_MIN_SIMILARITY:
+        print(f"Embedding backend {backend} is below the minimum similarity {settings.EMBEDDING_PARITY_MIN_SIMILARITY}, using torch")
+        return reference_model, "torch"
+    return model, backend
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from executor import Overloaded
+
+# Coalesces concurrent single-text encodes into batched model calls.
+# The first waiting text opens a batch that is closed after max_wait_ms or once it holds max_batch_size texts;
+# texts arriving while a batch is being encoded are collected into the next one.
+class QueryBatcher:
+    def __init__(self, encode, executor, max_batch_size: int, max_wait_ms: float, max_pending: int):
+        """
+        :param encode: A blocking callable taking a list of texts and returning one vector per text.
+        :param executor: The BoundedExecutor the batches are encoded on.
+        :param max_batch_size: The maximum number of texts encoded together.
+        :param max_wait_ms: How long the first text of a batch waits for others to join it.
+        :param max_pending: The maximum number of texts waiting for a batch; more are rejected with Overloaded.
+        """
+        self._encode = encode
+        self._executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_pending = max_pending
+        self.batches = 0
+        self.items = 0
+        self.histogram = {}  # upper bound of the batch size bucket (1, 2, 4, 8, ...) -> number of batches
+        self._queue = None
+        self._task = None
+        self._stats_lock = threading.Lock()
+
+    # Encode one text as part of the next batch and return its vector
+    async def encode(self, text: str):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            raise Overloaded()
+        return await future
+
+    # Helper function to collect the texts of the next batch
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    # Background task encoding the batches one after the other
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            # Callers that went away (e.g. disconnected clients) do not need encoding
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            self._record(len(batch))
+            try:
+                vectors = await self._executor.run(self._encode, [text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    # Helper function to count a batch in the size histogram
+    def _record(self, size: int):
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        with self._stats_lock:
+            self.batches += 1
+            self.items += size
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+                "batch_size_histogram": {str(bucket): count for bucket, count in sorted(self.histogram.items())},
+            }
@@ -0,0 +1,57 @@
+import argparse
+import time
+import numpy as np
+from config import settings
+from backends import BACKENDS, PARITY_SENTENCES, load_embedding_model, check_parity
+
+# Benchmark the embedding backends on this machine:
+#   python benchmark.py --backends torch onnx onnx-int8 --chunks 512 --queries 200
+# Reports parity against torch, ingestion throughput (chunks/sec on chunk-sized texts) and query latency
+# (single-sentence encodes, p50/p95 in ms).
+
+# Helper function to build chunk-sized texts (roughly 512 tokens each)
+def sample_chunks(count: int):
+    paragraph = " ".join(PARITY_SENTENCES)
+    return [f"{i} {paragraph * 5}" for i in range(count)]
+
+# Helper function to measure one backend
+def benchmark_backend(model, chunks: list, queries: list, batch_size: int):
+    # warm up
+    model.encode(chunks[:batch_size], batch_size=batch_size)
+    model.encode(queries[0])
+
+    start = time.perf_counter()
+    model.encode(chunks, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        model.encode(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "chunks_per_second": round(len(chunks) / elapsed, 2),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the throughput, latency and parity of the embedding backends")
+    parser.add_argument("--model", default=settings.EMBEDDING_MODEL_NAME)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--chunks", type=int, default=512, help="number of chunk-sized texts encoded for throughput")
+    parser.add_argument("--queries", type=int, default=200, help="number of single-sentence encodes timed for latency")
+    parser.add_argument("--batch-size", type=int, default=settings.EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+
+    chunks = sample_chunks(args.chunks)
+    queries = [PARITY_SENTENCES[i % len(PARITY_SENTENCES)] for i in range(args.queries)]
+    reference_model = load_embedding_model(args.model, "torch")
+
+    for backend in args.backends:
+        model = reference_model if backend == "torch" else load_embedding_model(args.model, backend)
+        result = benchmark_backend(model, chunks, queries, args.batch_size)
+        if backend != "torch":
+            result.update(check_parity(reference_model, model))
+        print(backend, result)
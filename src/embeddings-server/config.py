@@ -11,9 +11,33 @@ class Settings(BaseSettings):
     AGENTS_DIR: str = os.path.join(os.getenv('DATA_DIR'), 'agents')
     MODELS_DIR: str = os.path.join(os.getenv('DATA_DIR'), 'models')
     STORE_DIR: str = os.path.join(os.getenv('DATA_DIR'), 'store')
+    MANIFESTS_DIR: str = os.path.join(os.getenv('DATA_DIR'), 'manifests')
+    EMBEDDING_CACHE_DIR: str = os.path.join(os.getenv('DATA_DIR'), 'cache', 'embeddings')
     EMBEDDING_MODEL_NAME: str = os.getenv('EMBEDDING_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
     EMBEDDING_MODEL_FILENAME: str = os.getenv('EMBEDDING_MODEL_FILENAME','pytorch_model.bin') 
     HF_API_TOKEN: str = os.getenv('HF_API_TOKEN')
+    EMBEDDING_BACKEND: str = os.getenv('EMBEDDING_BACKEND', 'torch') # torch, onnx or onnx-int8 (see backends.py)
+    ONNX_QUANTIZATION_CONFIG: str = os.getenv('ONNX_QUANTIZATION_CONFIG', 'avx2') # arm64, avx2, avx512 or avx512_vnni
+    EMBEDDING_PARITY_CHECK: bool = os.getenv('EMBEDDING_PARITY_CHECK', 'true').lower() == 'true' # compare a non-torch backend against torch at startup
+    EMBEDDING_PARITY_MIN_SIMILARITY: float = float(os.getenv('EMBEDDING_PARITY_MIN_SIMILARITY', 0.98)) # below this the server falls back to torch
+    EMBEDDING_BATCH_SIZE: int = int(os.getenv('EMBEDDING_BATCH_SIZE', 32)) # chunks per encode call, tuned for CPU
+    STORE_WRITE_BATCH_SIZE: int = int(os.getenv('STORE_WRITE_BATCH_SIZE', 1000)) # chunks per chromadb upsert call
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 100000)) # cached chunk vectors kept on disk, 0 disables the cache
+    PROMPT_EMBEDDING_CACHE_SIZE: int = int(os.getenv('PROMPT_EMBEDDING_CACHE_SIZE', 10000)) # prompt vectors kept in memory
+    RETRIEVAL_CACHE_SIZE: int = int(os.getenv('RETRIEVAL_CACHE_SIZE', 10000)) # /query results kept in memory
+    QUERY_CACHE_TTL_SECONDS: float = float(os.getenv('QUERY_CACHE_TTL_SECONDS', 3600)) # time to live of both caches
+    QUERY_BATCH_MAX_SIZE: int = int(os.getenv('QUERY_BATCH_MAX_SIZE', 32)) # prompts encoded together by /query
+    QUERY_BATCH_MAX_WAIT_MS: float = float(os.getenv('QUERY_BATCH_MAX_WAIT_MS', 5)) # how long a prompt waits for others to join its batch
+    RETRIEVAL_CANDIDATES_FACTOR: int = int(os.getenv('RETRIEVAL_CANDIDATES_FACTOR', 3)) # chunks retrieved per top_k chunk when /query selects
+    QUERY_BATCH_MAX_ITEMS: int = int(os.getenv('QUERY_BATCH_MAX_ITEMS', 1000)) # items accepted by /query/batch
+    INFERENCE_WORKERS: int = int(os.getenv('INFERENCE_WORKERS', 2)) # threads running model inference and chromadb calls for /query
+    INFERENCE_QUEUE_SIZE: int = int(os.getenv('INFERENCE_QUEUE_SIZE', 16)) # calls waiting for an inference thread before 503 is returned
+    RETRY_AFTER_SECONDS: int = int(os.getenv('RETRY_AFTER_SECONDS', 1)) # Retry-After sent with 503 responses
+    JOB_WORKERS: int = int(os.getenv('JOB_WORKERS', 2)) # ingestion jobs running at the same time
+    JOB_QUEUE_SIZE: int = int(os.getenv('JOB_QUEUE_SIZE', 32)) # jobs waiting for a job thread before /generate returns 503
+    PARSE_WORKERS: int = int(os.getenv('PARSE_WORKERS', os.cpu_count() or 1)) # processes parsing and chunking files
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv('PIPELINE_QUEUE_SIZE', 2)) # batches buffered between ingestion stages
+    MAX_FINISHED_JOBS: int = int(os.getenv('MAX_FINISHED_JOBS', 100)) # completion records kept in memory
     CORS_ALLOWED_ORIGINS: str = os.getenv('CORS_ALLOWED_ORIGINS', '') # defaults to none
     HEADER_KEY: str = 'XteNATqxnbBkPa6TCHcK0NTxOM1JVkQl' # this key cannot be changed because it is sent from the react frontend
 
@@ -0,0 +1,93 @@
+import numpy as np
+from llama_index.core.utils import get_tokenizer
+
+# Neighbouring chunks share chunk_overlap tokens; shorter common text is not treated as overlap
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+
+# Helper function to count tokens with the tokenizer used for chunking
+def count_tokens(text: str):
+    return len(get_tokenizer()(text))
+
+# Helper function to normalize vectors to unit length (so dot products are cosine similarities)
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+# Helper function to find the length of the longest suffix of a that is a prefix of b
+def _overlap_length(a: str, b: str):
+    for length in range(min(len(a), len(b), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:length]):
+            return length
+    return 0
+
+# Helper function to remove from a chunk the text it shares with the chunks already selected
+def _trim_overlap(text: str, selected: list):
+    for other in selected:
+        # The chunk starts with the end of a selected chunk
+        length = _overlap_length(other, text)
+        if length:
+            text = text[length:]
+        # The chunk ends with the start of a selected chunk
+        length = _overlap_length(text, other)
+        if length:
+            text = text[:-length]
+    return text.strip()
+
+# Select the chunks to put in the LLM prompt
+def select_chunks(prompt_embedding, documents: list, embeddings: list, top_k: int, min_similarity: float = None,
+                  dedup_threshold: float = None, mmr_lambda: float = 1.0, token_budget: int = None):
+    """
+    Picks up to top_k chunks from the retrieved candidates with maximal marginal relevance (MMR):
+    every step takes the chunk maximizing mmr_lambda * similarity to the prompt - (1 - mmr_lambda) * the highest
+    similarity to a chunk already taken. Chunks below min_similarity, near-duplicates of a chunk already taken
+    (similarity >= dedup_threshold) and chunks that no longer fit in token_budget are skipped, and text shared
+    with neighbouring chunks (the splitter's overlap) is removed.
+
+    :param prompt_embedding: The embedding of the prompt.
+    :param documents: The candidate chunks, closest first.
+    :param embeddings: The embeddings of the candidate chunks.
+    :param top_k: The maximum number of chunks to return.
+    :param min_similarity: The minimum cosine similarity to the prompt, or None for no cutoff.
+    :param dedup_threshold: The cosine similarity above which a chunk counts as a duplicate, or None to keep duplicates.
+    :param mmr_lambda: The relevance / diversity trade-off; 1.0 keeps the order of relevance.
+    :param token_budget: The maximum number of tokens of all selected chunks, or None for no limit.
+
+    :return: A tuple (chunks, stats) where stats holds the tokens of the selected chunks and the tokens saved
+             compared to the plain top_k chunks.
+    """
+    baseline_tokens = sum(count_tokens(document) for document in documents[:top_k])
+    if not documents:
+        return [], {"context_tokens": 0, "context_tokens_saved": 0}
+
+    query = _normalize(prompt_embedding)
+    candidates = _normalize(embeddings)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    remaining = [i for i in range(len(documents)) if min_similarity is None or relevance[i] >= min_similarity]
+    selected = []
+    chunks = []
+    used_tokens = 0
+    while remaining and len(chunks) < top_k:
+        if selected:
+            redundancy = similarity[remaining][:, selected].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(scores))
+        index = remaining.pop(best)
+        if dedup_threshold is not None and redundancy[best] >= dedup_threshold:
+            continue
+        text = _trim_overlap(documents[index], [documents[i] for i in selected])
+        if not text:
+            continue
+        tokens = count_tokens(text)
+        if token_budget is not None and used_tokens + tokens > token_budget:
+            continue
+        selected.append(index)
+        chunks.append(text)
+        used_tokens += tokens
+
+    return chunks, {"context_tokens": used_tokens, "context_tokens_saved": max(0, baseline_tokens - used_tokens)}
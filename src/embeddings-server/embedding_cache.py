@@ -0,0 +1,129 @@
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+# Content-addressed cache of chunk embeddings, keyed by (model name, sha256 of the chunk text).
+# Vectors live in a fixed-size float32 memory-mapped file (one row per slot) and an sqlite index maps
+# each key to its slot. When every slot is taken the least recently used entry is evicted.
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str, dimension: int, max_entries: int):
+        self.max_entries = max_entries
+        self.dimension = dimension
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        # One directory per model so vectors of different models never mix
+        model_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+        os.makedirs(model_dir, exist_ok=True)
+        vectors_path = os.path.join(model_dir, f"vectors-{dimension}.f32")
+        # Grow the (sparse) vectors file to the configured capacity; a larger existing file is simply read in part
+        with open(vectors_path, "ab") as f:
+            if f.tell() < max_entries * dimension * 4:
+                f.truncate(max_entries * dimension * 4)
+        self._vectors = np.memmap(vectors_path, dtype=np.float32, mode="r+", shape=(max_entries, dimension))
+
+        self._db = sqlite3.connect(os.path.join(model_dir, f"index-{dimension}.db"), check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+        # Entries beyond the current capacity (if it was lowered) are dropped
+        self._db.execute("DELETE FROM entries WHERE slot >= ?", (max_entries,))
+        self._db.commit()
+
+        # key -> slot, least recently used first
+        self._slots = OrderedDict(self._db.execute("SELECT key, slot FROM entries ORDER BY last_used").fetchall())
+        used = set(self._slots.values())
+        self._free_slots = [slot for slot in range(max_entries - 1, -1, -1) if slot not in used]
+
+    # Helper function to build the cache key of a chunk
+    @staticmethod
+    def key(text: str):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    # Look up the vectors of the given texts; returns a list with a vector or None for each text
+    def get_many(self, texts: list):
+        keys = [self.key(text) for text in texts]
+        vectors = []
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    self.misses += 1
+                    vectors.append(None)
+                else:
+                    self.hits += 1
+                    self._slots.move_to_end(key)
+                    vectors.append(np.array(self._vectors[slot]))
+            hit_keys = [(now, key) for key, vector in zip(keys, vectors) if vector is not None]
+            if hit_keys:
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", hit_keys)
+                self._db.commit()
+        return vectors
+
+    # Store the vectors of the given texts, evicting the least recently used entries if needed
+    def put_many(self, texts: list, vectors):
+        now = time.time()
+        with self._lock:
+            rows = {}
+            for text, vector in zip(texts, vectors):
+                key = self.key(text)
+                if key in self._slots:
+                    continue
+                if self._free_slots:
+                    slot = self._free_slots.pop()
+                else:
+                    evicted_key, slot = self._slots.popitem(last=False)
+                    if rows.pop(evicted_key, None) is None:
+                        self._db.execute("DELETE FROM entries WHERE key = ?", (evicted_key,))
+                    self.evictions += 1
+                self._vectors[slot] = vector
+                self._slots[key] = slot
+                rows[key] = slot
+            if rows:
+                self._vectors.flush()
+                self._db.executemany("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                     [(key, slot, now) for key, slot in rows.items()])
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._slots),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+# Encode texts, reusing cached vectors and sending only the misses to the model
+def encode_with_cache(cache: EmbeddingCache, model, texts: list, batch_size: int):
+    """
+    Returns the embeddings of texts as a float32 array, in order.
+
+    :param cache: The embedding cache, or None to always encode.
+    :param model: The SentenceTransformer used for the texts that are not cached.
+    :param texts: The texts to encode.
+    :param batch_size: The batch size passed to the model.
+    """
+    if cache is None:
+        return model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    vectors = cache.get_many(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        # Identical chunks within the batch are encoded once
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+        encoded = model.encode(missing_texts, batch_size=batch_size, convert_to_numpy=True)
+        cache.put_many(missing_texts, encoded)
+        encoded_by_text = dict(zip(missing_texts, encoded))
+        for i in missing:
+            vectors[i] = encoded_by_text[texts[i]]
+    return np.asarray(vectors, dtype=np.float32).reshape(len(texts), cache.dimension)
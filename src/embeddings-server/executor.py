@@ -0,0 +1,51 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Raised when the executor's wait queue is full; the API answers it with 503 and Retry-After
+class Overloaded(Exception):
+    pass
+
+# Thread pool with a bounded number of running plus waiting calls.
+# Calls beyond max_workers + max_queue are rejected right away instead of letting latency grow without limit.
+class BoundedExecutor:
+    def __init__(self, max_workers: int, max_queue: int, name: str):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.rejected = 0
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    # Submit a blocking call; raises Overloaded when the wait queue is full
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise Overloaded()
+            self.pending += 1
+            self.submitted += 1
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._release)
+        return future
+
+    # Run a blocking call on the executor and await its result
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    # Helper function called when a call has finished
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": min(self.pending, self.max_workers),
+                "queued": max(0, self.pending - self.max_workers),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+            }
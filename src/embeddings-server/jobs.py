@@ -0,0 +1,130 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from config import settings
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+# Raised inside a running job once cancellation has been requested
+class JobCancelled(Exception):
+    pass
+
+# An ingestion job and its progress / completion record
+class Job:
+    def __init__(self, agent_name: str, full_rebuild: bool = False):
+        self.id = uuid.uuid4().hex
+        self.agent_name = agent_name
+        self.full_rebuild = full_rebuild
+        self.status = QUEUED
+        self.files_total = 0
+        self.files_parsed = 0
+        self.chunks_total = 0
+        self.chunks_embedded = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.embedding_started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    # Request cancellation; the job stops at its next checkpoint
+    def cancel(self):
+        self._cancel_event.set()
+
+    # Checkpoint called by the job between units of work
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    # Estimated seconds left, based on the embedding rate observed so far
+    def eta_seconds(self):
+        if self.status != RUNNING or not self.embedding_started_at or not self.chunks_embedded:
+            return None
+        rate = self.chunks_embedded / (time.time() - self.embedding_started_at)
+        # While files are still being parsed, extrapolate the total from the chunks per file seen so far
+        chunks_total = self.chunks_total
+        if 0 < self.files_parsed < self.files_total:
+            chunks_total = self.chunks_total * self.files_total / self.files_parsed
+        return round(max(0, chunks_total - self.chunks_embedded) / rate, 1) if rate > 0 else None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "agent_name": self.agent_name,
+            "status": self.status,
+            "files_total": self.files_total,
+            "files_parsed": self.files_parsed,
+            "chunks_total": self.chunks_total,
+            "chunks_embedded": self.chunks_embedded,
+            "eta_seconds": self.eta_seconds(),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+# In-memory job registry (finished jobs are kept up to a limit so their records can be read back)
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+# One lock per agent so two jobs never index the same agent at the same time
+_agent_locks = {}
+
+# Helper function to create and register a new job
+def create_job(agent_name: str, full_rebuild: bool = False):
+    return register_job(Job(agent_name, full_rebuild))
+
+# Helper function to register a job so that its progress and completion record can be read back
+def register_job(job: Job):
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [j.id for j in _jobs.values() if j.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - settings.MAX_FINISHED_JOBS)]:
+            del _jobs[job_id]
+    return job
+
+# Helper function to look up a job by id
+def get_job(job_id: str):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+# Helper function to list jobs, optionally for a single agent
+def list_jobs(agent_name: str = None):
+    with _jobs_lock:
+        return [job for job in _jobs.values() if agent_name is None or job.agent_name == agent_name]
+
+# Helper function to get the lock serializing jobs of an agent
+def agent_lock(agent_name: str):
+    with _jobs_lock:
+        return _agent_locks.setdefault(agent_name, threading.Lock())
+
+# Run a job to completion in the calling (worker) thread, recording its outcome
+def run_job(job: Job, work):
+    """
+    Runs work(job) once no other job holds the agent, and records the outcome on the job.
+
+    :param job: The job to run.
+    :param work: A callable taking the job and returning the result dictionary.
+    """
+    with agent_lock(job.agent_name):
+        try:
+            job.check_cancelled()
+            job.status = RUNNING
+            job.started_at = time.time()
+            job.result = work(job)
+            job.status = COMPLETED
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
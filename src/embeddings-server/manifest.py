@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+from config import settings
+
+# The manifest records the embedding model (and backend) of the index and, for every file of an agent, the content
+# hash it was indexed with and the number of chunks written for it, e.g.
+# {"model": "all-MiniLM-L6-v2@torch", "files": {"guide.pdf": {"hash": "ab12...", "chunks": 42}}}
+
+# Helper function to get the manifest path for an agent
+def manifest_path(agent_name: str):
+    return os.path.join(settings.MANIFESTS_DIR, f"{agent_name}.json")
+
+# Helper function to load the manifest of an agent (empty if it has never been indexed)
+def load_manifest(agent_name: str):
+    path = manifest_path(agent_name)
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+# Helper function to save the manifest of an agent atomically
+def save_manifest(agent_name: str, manifest: dict):
+    os.makedirs(settings.MANIFESTS_DIR, exist_ok=True)
+    path = manifest_path(agent_name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+# Helper function to list the agents that have a manifest
+def list_manifest_agents():
+    if not os.path.isdir(settings.MANIFESTS_DIR):
+        return []
+    return [filename[:-len(".json")] for filename in os.listdir(settings.MANIFESTS_DIR) if filename.endswith(".json")]
+
+# Helper function to delete the manifest of an agent
+def delete_manifest(agent_name: str):
+    path = manifest_path(agent_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+# Helper function to hash the content of a file without reading it all into memory
+def hash_file(file_path: str):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# Helper function to build the file-scoped id of a chunk
+def chunk_id(filename: str, index: int):
+    return f"{filename}::chunk_{index}"
+
+# Helper function to list the ids of all chunks recorded for a file
+def chunk_ids(filename: str, chunk_count: int):
+    return [chunk_id(filename, i) for i in range(chunk_count)]
+
+# Helper function to compare the files in the agent directory against the manifest
+def diff_agent_files(agent_dir: str, manifest: dict):
+    """
+    Returns the files that need to be (re-)embedded and the files whose vectors must be removed.
+
+    :param agent_dir: The directory holding the agent's documents.
+    :param manifest: The manifest the agent was last indexed with.
+
+    :return: A tuple (changed, removed, hashes) where changed is a list of filenames that are new or
+             whose content differs, removed is a list of filenames no longer on disk, and hashes maps
+             every current filename to its content hash.
+    """
+    indexed_files = manifest.get("files", {})
+    hashes = {}
+    for filename in sorted(os.listdir(agent_dir)):
+        file_path = os.path.join(agent_dir, filename)
+        if os.path.isfile(file_path) and not filename.startswith("."):
+            hashes[filename] = hash_file(file_path)
+
+    changed = [filename for filename, file_hash in hashes.items()
+               if indexed_files.get(filename, {}).get("hash") != file_hash]
+    removed = [filename for filename in indexed_files if filename not in hashes]
+    return changed, removed, hashes
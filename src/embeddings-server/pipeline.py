@@ -0,0 +1,142 @@
+import os
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from llama_index.core.text_splitter import TokenTextSplitter
+from llama_index.core.readers.file.base import SimpleDirectoryReader
+from config import settings
+from manifest import chunk_id
+
+# Marks the end of a stage's output
+_END = object()
+
+# Carries an exception raised inside a stage to the consumer of its queue
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+# Helper function to put an item on a bounded queue, giving up once the pipeline is stopped
+def _put(out_queue: queue.Queue, item, stop_event: threading.Event):
+    while not stop_event.is_set():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+# Helper function to read the items of a bounded queue until the end of the stage
+def _drain(out_queue: queue.Queue, stop_event: threading.Event):
+    while not stop_event.is_set():
+        try:
+            item = out_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+# Run a generator as a pipeline stage in its own thread
+def start_stage(items, maxsize: int, stop_event: threading.Event):
+    """
+    Consumes the iterable items in a background thread and hands its output over through a bounded queue,
+    so the stage never runs more than maxsize items ahead of its consumer.
+
+    :param items: The iterable (usually a generator over the previous stage) producing this stage's output.
+    :param maxsize: The maximum number of items waiting in the queue.
+    :param stop_event: Set by the consumer to stop every stage of the pipeline.
+
+    :return: A generator yielding the stage's items in order; exceptions raised in the stage are re-raised here.
+    """
+    out_queue = queue.Queue(maxsize=maxsize)
+
+    def worker():
+        try:
+            for item in items:
+                if not _put(out_queue, item, stop_event):
+                    return
+        except BaseException as e:
+            _put(out_queue, _StageError(e), stop_event)
+            return
+        _put(out_queue, _END, stop_event)
+
+    threading.Thread(target=worker, daemon=True).start()
+    return _drain(out_queue, stop_event)
+
+# Helper function to load one file and split it into chunks with overlap (ignoring sentence/chapter boundaries)
+def load_file_chunks(file_path: str):
+    text_splitter = TokenTextSplitter(chunk_size=512, chunk_overlap=50)
+    chunks = []
+    for doc in SimpleDirectoryReader(input_files=[file_path]).load_data():
+        chunks.extend(text_splitter.split_text(doc.text))
+    return chunks
+
+# Worker process pool shared by all jobs for parsing and chunking files (created on first use)
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+# Helper function to get the parse pool. Workers are spawned rather than forked so they start clean
+# (without the embedding model or the threads of the server) and only import this module.
+def get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+# Parse and chunk the files in order, fanning the work out to the parse pool when more than one worker is configured
+def iter_file_chunks(agent_dir: str, filenames: list, job):
+    if settings.PARSE_WORKERS <= 1:
+        for filename in filenames:
+            job.check_cancelled()
+            yield filename, load_file_chunks(os.path.join(agent_dir, filename))
+        return
+
+    # Keep at most two files per worker in flight so parsed chunks never pile up ahead of the encoder
+    pool = get_parse_pool()
+    pending = deque()
+    remaining = iter(filenames)
+    try:
+        for filename in remaining:
+            pending.append((filename, pool.submit(load_file_chunks, os.path.join(agent_dir, filename))))
+            if len(pending) >= 2 * settings.PARSE_WORKERS:
+                break
+        while pending:
+            job.check_cancelled()
+            filename, future = pending.popleft()
+            chunks = future.result()
+            next_filename = next(remaining, None)
+            if next_filename is not None:
+                pending.append((next_filename, pool.submit(load_file_chunks, os.path.join(agent_dir, next_filename))))
+            yield filename, chunks
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+# Group the chunks of the files into batches of (id, filename, text)
+def iter_chunk_batches(agent_dir: str, filenames: list, batch_size: int, job, chunk_counts: dict):
+    """
+    Yields batches of chunks for the given files, parsing files in the worker pool and in order.
+
+    :param agent_dir: The directory holding the agent's documents.
+    :param filenames: The files to read.
+    :param batch_size: The number of chunks in each batch (the last one may be smaller).
+    :param job: The job to report parsing progress to and check for cancellation.
+    :param chunk_counts: Filled with the number of chunks produced for each file.
+    """
+    batch = []
+    for filename, chunks in iter_file_chunks(agent_dir, filenames, job):
+        chunk_counts[filename] = len(chunks)
+        job.chunks_total += len(chunks)
+        job.files_parsed += 1
+        for i, chunk in enumerate(chunks):
+            batch.append((chunk_id(filename, i), filename, chunk))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,69 @@
+import threading
+
+# Registry of open chromadb collection handles, one per agent.
+# Lookups never create collections. The names of the collections in the store are listed once at startup and kept
+# up to date by open() and delete(), so an agent that was never indexed is rejected without touching the store.
+# Collections indexed before manifests existed have none; their next indexing job rebuilds them with a manifest.
+class CollectionRegistry:
+    def __init__(self, client):
+        self._client = client
+        self._collections = {}
+        # chromadb returns collection objects (before 0.6) or collection names
+        self._known = {getattr(collection, "name", collection) for collection in client.list_collections()}
+        self._lock = threading.Lock()
+
+    # Helper function to get the collection name of an agent
+    @staticmethod
+    def collection_name(agent_name: str):
+        return f"agent_{agent_name}"
+
+    # Get the open handle of an agent's collection, or None if it has not been opened yet (never blocks)
+    def cached(self, agent_name: str):
+        with self._lock:
+            return self._collections.get(agent_name)
+
+    # Tell whether the store has a collection for an agent (never blocks)
+    def known(self, agent_name: str):
+        with self._lock:
+            return self.collection_name(agent_name) in self._known
+
+    # Get the collection of an indexed agent, or None if the agent has no embeddings (blocking on a miss)
+    def get(self, agent_name: str):
+        collection = self.cached(agent_name)
+        if collection is not None:
+            return collection
+        if not self.known(agent_name):
+            return None
+        try:
+            collection = self._client.get_collection(name=self.collection_name(agent_name))
+        except Exception:
+            return None  # The collection does not exist
+        with self._lock:
+            return self._collections.setdefault(agent_name, collection)
+
+    # Get the collection of an agent, creating it if needed (used by ingestion only)
+    def open(self, agent_name: str):
+        collection = self._client.get_or_create_collection(name=self.collection_name(agent_name))
+        with self._lock:
+            self._collections[agent_name] = collection
+            self._known.add(self.collection_name(agent_name))
+        return collection
+
+    # Drop the collection of an agent from the store and the registry
+    def delete(self, agent_name: str):
+        self.invalidate(agent_name)
+        with self._lock:
+            self._known.discard(self.collection_name(agent_name))
+        try:
+            self._client.delete_collection(name=self.collection_name(agent_name))
+        except Exception:
+            pass  # The collection does not exist
+
+    # Forget the handle of an agent so that the next lookup reopens it
+    def invalidate(self, agent_name: str):
+        with self._lock:
+            self._collections.pop(agent_name, None)
+
+    def stats(self):
+        with self._lock:
+            return {"open_collections": len(self._collections), "known_collections": len(self._known)}